@@ -1,50 +1,14 @@
 import gradio as gr
 from dotenv import load_dotenv
-from langchain_core.messages import ToolMessage
 
-from utils.agent_utils import create_primary_assistant_runnable_and_build_graph
+from utils.agent_utils import create_primary_assistant_runnable_and_build_graph, run_chat_turn
 from utils.configs import ENV_FILE_PATH
 
-SYSTEM_INTERRUPT_FLAG = False
 def sync_chatbot_response(message, history, graph, config):
     """Synchronous chatbot response generator."""
-    global SYSTEM_INTERRUPT_FLAG
     try:
-        if not SYSTEM_INTERRUPT_FLAG:
-            response = graph.invoke({
-                "messages": [("user", message)]
-            }, config)['messages'][-1].content
-
-            bot_response = response
-            snapshot = graph.get_state(config)
-            if snapshot.next:
-                # This is for interruption
-                print(f"Coming here: {snapshot.next}")
-                SYSTEM_INTERRUPT_FLAG = True
-                response = "Should I generate the RA number for you? yes/no"
-                bot_response = response
-            history.append((f"👤 {message}", f"🤖 {bot_response}"))
-        else:
-            if message.lower().startswith("yes"):
-                response = graph.invoke(
-                    None,
-                    config,
-                )['messages'][-1].content
-            else:
-                snapshot = graph.get_state(config)
-                response = graph.invoke({
-                    "messages": [
-                        ToolMessage(
-                            # tool_call_id=response['messages'][-1].tool_call_id,
-                            tool_call_id=snapshot.values['messages'][-1].tool_calls[0]['id'],
-                            content=f"Generate-Return-Authorization denied by user. Reasoning: '{message}'. Proceed with last conversation.",
-                        )]
-                },
-                config,
-            )['messages'][-1].content
-            bot_response = response
-            history.append((f"👤 {message}", f"🤖 {bot_response}"))
-            SYSTEM_INTERRUPT_FLAG = False
+        bot_response, _ = run_chat_turn(graph, config, message)
+        history.append((f"👤 {message}", f"🤖 {bot_response}"))
         return history, ""
     except Exception as e:
         print(f"Sync Error: {e}")
@@ -0,0 +1,107 @@
+"""Benchmarks the local IVF vector index against exact (brute-force) search.
+
+Builds an index in a temporary directory from clustered synthetic vectors (or from
+an .npy matrix of real embeddings), then reports recall@k of the IVF search against
+exact search, and the queries per second of both, for several nprobe values.
+
+Run from the repository root:
+    python -m benchmarks.ann_index --rows 200000 --k 10
+    python -m benchmarks.ann_index --embeddings policy_embeddings.npy
+"""
+
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from utils.vector_index import LocalVectorIndex, normalize
+
+INTENTS = ["return", "refund", "exchange", "damaged item", "shipping", "payment", "replacement"]
+
+
+def make_vectors(rows: int, dims: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Clustered random vectors, closer to real sentence embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(clusters, dims)))
+    labels = rng.integers(0, clusters, size=rows)
+    # Noise of norm ~0.7 around unit length cluster centers
+    return normalize(centers[labels] + rng.normal(scale=0.7 / np.sqrt(dims), size=(rows, dims)))
+
+
+def build_index(index_dir: str, vectors: np.ndarray, batch_size: int = 5000) -> LocalVectorIndex:
+    """Inserts the vectors in batches, the way the ingestion service does."""
+    index = LocalVectorIndex(index_dir, vectors.shape[1])
+    start = time.perf_counter()
+    for i in range(0, len(vectors), batch_size):
+        index.upsert([
+            {
+                "id": f"{row:064d}",
+                "values": vectors[row],
+                "metadata": {"text": f"sentence {row}", "intents": [INTENTS[row % len(INTENTS)]]},
+            }
+            for row in range(i, min(i + batch_size, len(vectors)))
+        ])
+    if index.centroids is None:
+        index.train()
+    print(f"Built index of {index.count} vectors with {index.meta['nlist']} lists "
+          f"in {time.perf_counter() - start:.1f}s")
+    return index
+
+
+def recall_at_k(exact: list, approximate: list, k: int) -> float:
+    """Mean fraction of the exact top k found by the approximate search."""
+    return float(np.mean([
+        len({m["id"] for m in e} & {m["id"] for m in a}) / max(1, min(k, len(e)))
+        for e, a in zip(exact, approximate)
+    ]))
+
+
+def run_benchmark(vectors: np.ndarray, queries: np.ndarray, k: int, nprobes: list, filtered: bool) -> None:
+    with tempfile.TemporaryDirectory() as index_dir:
+        build_index(index_dir, vectors)
+
+        start = time.perf_counter()
+        index = LocalVectorIndex(index_dir, vectors.shape[1], readonly=True)
+        print(f"Memory mapped load in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        filters = None
+        if filtered:
+            filters = [{"intents": {"$in": [INTENTS[i % len(INTENTS)]]}} for i in range(len(queries))]
+
+        start = time.perf_counter()
+        exact = index.search_exact(queries, k, filters)
+        exact_qps = len(queries) / (time.perf_counter() - start)
+        print(f"exact      : {exact_qps:10.1f} queries/s")
+
+        for nprobe in nprobes:
+            index.nprobe = nprobe
+            start = time.perf_counter()
+            approximate = [index.query(query, k, filter=filters[i] if filters else None)["matches"]
+                           for i, query in enumerate(queries)]
+            qps = len(queries) / (time.perf_counter() - start)
+            print(f"nprobe={nprobe:<4}: {qps:10.1f} queries/s  recall@{k}={recall_at_k(exact, approximate, k):.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", help=".npy matrix of embeddings to index instead of synthetic vectors")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of synthetic vectors")
+    parser.add_argument("--dims", type=int, default=768, help="Dimensions of synthetic vectors")
+    parser.add_argument("--clusters", type=int, default=1000, help="Clusters of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=10, help="Number of neighbours per query")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32], help="nprobe values to test")
+    parser.add_argument("--filtered", action="store_true", help="Pre-filter each query by one intent")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        data = normalize(np.load(args.embeddings))
+    else:
+        data = make_vectors(args.rows + args.queries, args.dims, args.clusters)
+    rng = np.random.default_rng(1)
+    query_rows = rng.choice(len(data), args.queries, replace=False)
+    # Queries are held out rows, so they are not trivially found in the index
+    query_vectors = data[query_rows]
+    index_vectors = np.delete(data, query_rows, axis=0)
+
+    run_benchmark(index_vectors, query_vectors, args.k, args.nprobe, args.filtered)
@@ -0,0 +1,66 @@
+"""Compares the throughput of the single query policy retrieval with the batched
+retrieval API over an evaluation set of queries.
+
+Run from the repository root:
+    python -m benchmarks.batch_retrieval --queries eval_queries.jsonl
+The queries file has one query per line, either plain text or JSON with a "query" key.
+"""
+
+import json
+import time
+import argparse
+
+from utils.agent_tools import (
+    retrieve_relevant_policies_by_query,
+    retrieve_relevant_policies_by_queries,
+)
+
+
+def load_queries(path: str, limit: int) -> list:
+    """Loads the queries from a text or JSONL file."""
+    queries = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)["query"]
+            queries.append(line)
+            if len(queries) >= limit:
+                break
+    return queries
+
+
+def run_benchmark(queries: list, batch_size: int, single_sample: int) -> None:
+    """Times the single query tool on a sample and the batch API on all the queries."""
+    sample = queries[:single_sample]
+    start = time.perf_counter()
+    for query in sample:
+        retrieve_relevant_policies_by_query(query)
+    single_elapsed = time.perf_counter() - start
+    single_qps = len(sample) / single_elapsed
+
+    failed = 0
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        _, errors = retrieve_relevant_policies_by_queries(queries[i:i + batch_size])
+        failed += sum(error is not None for error in errors)
+    batch_elapsed = time.perf_counter() - start
+    batch_qps = len(queries) / batch_elapsed
+
+    print(f"Single query : {len(sample)} queries in {single_elapsed:.2f}s ({single_qps:.1f} queries/s)")
+    print(f"Batched      : {len(queries)} queries in {batch_elapsed:.2f}s ({batch_qps:.1f} queries/s, {failed} failed)")
+    print(f"Speedup      : {batch_qps / single_qps:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", required=True, help="Text or JSONL file with the evaluation queries")
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum number of queries to use")
+    parser.add_argument("--batch-size", type=int, default=256, help="Queries per batch API call")
+    parser.add_argument("--single-sample", type=int, default=100,
+                        help="Number of queries timed through the single query tool")
+    args = parser.parse_args()
+
+    run_benchmark(load_queries(args.queries, args.limit), args.batch_size, args.single_sample)
@@ -0,0 +1,70 @@
+"""Load test of the micro-batching embedding service.
+
+Concurrent clients each encode one query at a time, first by calling the model
+directly (the unbatched baseline) and then through the embedding service at several
+max wait times and max batch sizes. Reports the throughput and the p50/p95 latency of
+every setting, the trade-off curve for tuning EMBEDDING_MAX_WAIT_MS and
+EMBEDDING_MAX_BATCH_SIZE.
+
+Run from the repository root:
+    python -m benchmarks.embedding_service --clients 32 --wait-ms 0 2 5 10 --batch-sizes 16 64
+"""
+
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.configs import EMBEDDING_MODEL_NAME
+from utils.common import load_embedding_model
+from utils.embedding_service import EmbeddingService
+
+QUERIES = [
+    "What is the return policy?",
+    "I want my money back for a damaged pair of shoes",
+    "How long does shipping take?",
+    "Can I exchange my sneakers for a bigger size?",
+    "Which payment methods can I use for a refund?",
+    "My order arrived with a broken sole, what can I do?",
+    "Are final sale items eligible for an exchange?",
+    "How do I get a replacement for a wrong size?",
+]
+
+
+def run_load(encode, clients: int, requests: int) -> tuple:
+    """Runs the requests from concurrent clients, returns (queries/s, p50 ms, p95 ms)."""
+    def timed_encode(i):
+        start = time.perf_counter()
+        encode([QUERIES[i % len(QUERIES)]])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = list(executor.map(timed_encode, range(requests)))
+    qps = requests / (time.perf_counter() - start)
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return qps, p50, p95
+
+
+def report(name: str, result: tuple) -> None:
+    qps, p50, p95 = result
+    print(f"{name:<28}: {qps:8.1f} queries/s  p50 {p50:7.1f}ms  p95 {p95:7.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per setting")
+    parser.add_argument("--wait-ms", type=float, nargs="+", default=[0, 1, 2, 5, 10], help="Max wait times to test")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 64], help="Max batch sizes to test")
+    args = parser.parse_args()
+
+    model = load_embedding_model(EMBEDDING_MODEL_NAME)
+    # Warm up the model before timing
+    model.encode(QUERIES)
+
+    report("direct (unbatched)", run_load(model.encode, args.clients, args.requests))
+    for batch_size in args.batch_sizes:
+        for wait_ms in args.wait_ms:
+            service = EmbeddingService(model, max_batch_size=batch_size, max_wait_ms=wait_ms)
+            report(f"batch={batch_size:<3} wait={wait_ms:g}ms", run_load(service.encode, args.clients, args.requests))
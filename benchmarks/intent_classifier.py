@@ -0,0 +1,72 @@
+"""Compares the substring intent matching with the intent classifier over a labeled
+set of queries.
+
+Reports, for both, the share of queries which get an intents filter, the micro
+averaged precision and recall of the intents, and the added latency per query of the
+classifier on top of the query embedding.
+
+Run from the repository root, after the ingestion service trained the classifier:
+    python -m benchmarks.intent_classifier --queries labeled_queries.jsonl
+The queries file is JSONL with a "query" key and an "intents" list on each line.
+"""
+
+import json
+import time
+import argparse
+
+from utils.configs import SUPPORTED_INTENTS, EMBEDDING_MODEL_NAME, EMBEDDING_BATCH_SIZE
+from utils.common import load_embedding_model
+from utils.intent_classifier import get_intent_classifier
+
+
+def get_intents_from_query(query_text: str) -> list:
+    """The substring matching of utils.agent_tools, kept here to avoid connecting to
+    the vector index on import."""
+    return [intent for intent in SUPPORTED_INTENTS if intent in query_text.lower()]
+
+
+def load_labeled_queries(path: str) -> tuple:
+    queries, labels = [], []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                queries.append(record["query"])
+                labels.append({intent.lower() for intent in record.get("intents", [])})
+    return queries, labels
+
+
+def report(name: str, predicted: list, labels: list) -> None:
+    true_positives = sum(len(set(p) & l) for p, l in zip(predicted, labels))
+    predicted_count = sum(len(p) for p in predicted)
+    label_count = sum(len(l) for l in labels)
+    filtered = sum(1 for p in predicted if p) / max(1, len(predicted))
+    precision = true_positives / max(1, predicted_count)
+    recall = true_positives / max(1, label_count)
+    print(f"{name:<12}: filtered {filtered:6.1%}  precision {precision:6.1%}  recall {recall:6.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", required=True, help="JSONL file with the labeled queries")
+    args = parser.parse_args()
+
+    classifier = get_intent_classifier()
+    if classifier is None:
+        raise SystemExit("No intent classifier found, run the policy ingestion service first.")
+    queries, labels = load_labeled_queries(args.queries)
+    model = load_embedding_model(EMBEDDING_MODEL_NAME)
+
+    start = time.perf_counter()
+    vectors = model.encode(queries, batch_size=EMBEDDING_BATCH_SIZE)
+    encode_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    for vector in vectors:
+        classifier.predict([vector])
+    classify_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    substring = [get_intents_from_query(query) for query in queries]
+    combined = [sorted(set(s) | set(c)) for s, c in zip(substring, classifier.predict(vectors))]
+    report("substring", substring, labels)
+    report("classifier", combined, labels)
+    print(f"Latency per query: embedding {encode_ms:.2f}ms, classifier {classify_ms:.3f}ms")
@@ -0,0 +1,176 @@
+"""Profiles the memory of the chat process: the resident memory each module of the chat
+path adds at import, and the allocation hot spots of the chat turns.
+
+The imports mode imports the chat path modules one after another and reports the RSS
+and PSS growth and the import time of each. With --isolated every module is imported
+in a fresh interpreter instead, so a module is not credited with less because another
+one loaded its dependencies first. It also lists the ingestion and training modules
+(SLIM_SERVING_EXCLUDED_MODULES) the chat path imported, and which module pulled them in.
+
+The turns mode runs chat turns (or, with --retrieval-only, policy retrievals) under
+tracemalloc, after a warm-up turn, and reports the source lines which allocated the
+most memory over the turns that is still held, and the RSS after every turn.
+
+Run from the repository root:
+    python -m benchmarks.memory_profile imports --isolated
+    python -m benchmarks.memory_profile turns --turns 20 --retrieval-only
+"""
+
+import sys
+import json
+import time
+import uuid
+import argparse
+import importlib
+import subprocess
+import tracemalloc
+
+import psutil
+
+from utils.configs import SLIM_SERVING_EXCLUDED_MODULES
+
+# In import order of the chat path, the heavy third party modules first
+CHAT_PATH_MODULES = [
+    "numpy",
+    "torch",
+    "sentence_transformers",
+    "pinecone",
+    "langchain_core",
+    "langgraph",
+    "langchain_groq",
+    "utils.agent_tools",
+    "utils.agent_utils",
+]
+
+QUERIES = [
+    "What is the return policy?",
+    "I want my money back for a damaged pair of shoes",
+    "How long does shipping take?",
+    "Can I exchange my sneakers for a bigger size?",
+    "Which payment methods can I use for a refund?",
+]
+
+
+def read_memory_mb() -> tuple:
+    """Returns the (RSS, PSS) of this process in MB, PSS is None where unsupported."""
+    info = psutil.Process().memory_full_info()
+    return info.rss / 2**20, getattr(info, "pss", 0) / 2**20 or None
+
+
+def import_module(name: str) -> dict:
+    """Imports the module and returns its memory growth, import time and the excluded
+    modules it loaded."""
+    excluded_before = {module for module in SLIM_SERVING_EXCLUDED_MODULES if module in sys.modules}
+    rss_before, pss_before = read_memory_mb()
+    start = time.perf_counter()
+    importlib.import_module(name)
+    seconds = time.perf_counter() - start
+    rss_after, pss_after = read_memory_mb()
+    return {
+        "module": name,
+        "rss_mb": rss_after - rss_before,
+        "pss_mb": None if pss_after is None else pss_after - pss_before,
+        "seconds": seconds,
+        "excluded": sorted(
+            module for module in SLIM_SERVING_EXCLUDED_MODULES
+            if module in sys.modules and module not in excluded_before
+        ),
+    }
+
+
+def import_module_isolated(name: str) -> dict:
+    """Imports the module in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.memory_profile", "import-one", name],
+        check=True, capture_output=True, text=True
+    ).stdout
+    # The last line is the result, modules may print while they load
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def profile_imports(isolated: bool) -> None:
+    rss, _ = read_memory_mb()
+    print(f"Interpreter baseline: RSS {rss:.1f} MB")
+    print(f"{'module':<24} {'RSS MB':>8} {'PSS MB':>8} {'seconds':>8}")
+    results = []
+    for name in CHAT_PATH_MODULES:
+        result = import_module_isolated(name) if isolated else import_module(name)
+        results.append(result)
+        pss = "-" if result["pss_mb"] is None else f"{result['pss_mb']:.1f}"
+        print(f"{name:<24} {result['rss_mb']:8.1f} {pss:>8} {result['seconds']:8.2f}")
+
+    if not isolated:
+        rss, pss = read_memory_mb()
+        print(f"Total after imports: RSS {rss:.1f} MB" + ("" if pss is None else f", PSS {pss:.1f} MB"))
+    excluded = {result["module"]: result["excluded"] for result in results if result["excluded"]}
+    if excluded:
+        for name, modules in excluded.items():
+            print(f"Excluded from the slim serving profile, yet imported by {name}: {', '.join(modules)}")
+    else:
+        print("No module of the ingestion or training code was imported.")
+
+
+def profile_turns(turns: int, retrieval_only: bool, top: int) -> None:
+    from dotenv import load_dotenv
+    from utils.configs import ENV_FILE_PATH
+    load_dotenv(ENV_FILE_PATH)
+
+    if retrieval_only:
+        from utils.agent_tools import retrieve_relevant_policies_by_queries
+
+        def run_turn(i: int) -> None:
+            retrieve_relevant_policies_by_queries([QUERIES[i % len(QUERIES)]])
+    else:
+        from utils.agent_utils import create_primary_assistant_runnable_and_build_graph, run_chat_turn
+        graph = create_primary_assistant_runnable_and_build_graph()
+        config = {"configurable": {"thread_id": f"memory-profile-{uuid.uuid4().hex[:8]}"}}
+
+        def run_turn(i: int) -> None:
+            run_chat_turn(graph, config, QUERIES[i % len(QUERIES)])
+
+    # The warm-up turn loads the lazy state (caches, clients) which the other turns reuse
+    run_turn(0)
+    tracemalloc.start(25)
+    before = tracemalloc.take_snapshot()
+    rss_start, _ = read_memory_mb()
+    for i in range(1, turns + 1):
+        start = time.perf_counter()
+        run_turn(i)
+        rss, _ = read_memory_mb()
+        print(f"turn {i:3d}: {time.perf_counter() - start:6.2f}s  RSS {rss:.1f} MB ({rss - rss_start:+.1f})")
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    print(f"\nTop {top} allocation sites still held after {turns} turns:")
+    for stat in stats[:top]:
+        print(stat)
+    rss, _ = read_memory_mb()
+    print(f"RSS growth per turn: {(rss - rss_start) / turns * 1024:.1f} kB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    imports_parser = subparsers.add_parser("imports", help="Memory added by each module of the chat path")
+    imports_parser.add_argument("--isolated", action="store_true", help="Import every module in a fresh interpreter")
+    turns_parser = subparsers.add_parser("turns", help="Allocation hot spots of the chat turns")
+    turns_parser.add_argument("--turns", type=int, default=20, help="Turns to profile, after a warm-up turn")
+    turns_parser.add_argument("--retrieval-only", action="store_true",
+                              help="Profile the policy retrieval only, without the LLM")
+    turns_parser.add_argument("--top", type=int, default=15, help="Allocation sites to list")
+    # Used by --isolated, imports one module and prints the result as JSON
+    import_one_parser = subparsers.add_parser("import-one")
+    import_one_parser.add_argument("module")
+    args = parser.parse_args()
+
+    if args.mode == "imports":
+        profile_imports(args.isolated)
+    elif args.mode == "turns":
+        profile_turns(args.turns, args.retrieval_only, args.top)
+    else:
+        print(json.dumps(import_module(args.module)))
@@ -0,0 +1,113 @@
+"""Measures the requests per second and the memory of the multi-worker serving mode
+(serve.py) at several worker counts.
+
+For every worker count it starts the server, sends the requests from concurrent
+clients, each with its own conversation thread, and then reads the memory of the
+server processes from /proc (Linux only). RSS counts the pages shared copy-on-write
+by the workers once per process, PSS splits them between the processes sharing them,
+so the PSS total is the real memory used.
+
+Run from the repository root:
+    python -m benchmarks.serving --workers 1 2 4 8 --path /retrieve
+The default /retrieve path runs the policy retrieval only, /chat also calls the LLM.
+"""
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+QUERIES = [
+    "What is the return policy?",
+    "I want my money back for a damaged pair of shoes",
+    "How long does shipping take?",
+    "Can I exchange my sneakers for a bigger size?",
+    "Which payment methods can I use for a refund?",
+]
+
+
+def request(port: int, method: str, path: str, payload: dict = None, timeout: float = 120.0) -> dict:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        body = None if payload is None else json.dumps(payload)
+        connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path} failed with {response.status}: {data}")
+        return data
+    finally:
+        connection.close()
+
+
+def wait_until_ready(port: int, server: subprocess.Popen, timeout: float) -> dict:
+    """Polls the health endpoint until the dispatcher and all the workers answer."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            return request(port, "GET", "/health", timeout=5)
+        except (OSError, RuntimeError, http.client.HTTPException):
+            time.sleep(1)
+    raise TimeoutError(f"Server not ready after {timeout}s")
+
+
+def read_memory_kb(pid: int) -> tuple:
+    """Returns the (RSS, PSS) of a process in kB."""
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                memory[parts[0]] = int(parts[1])
+    return memory["Rss:"], memory["Pss:"]
+
+
+def make_payload(path: str, i: int) -> dict:
+    query = QUERIES[i % len(QUERIES)]
+    if path == "/chat":
+        return {"thread_id": f"benchmark-{i}", "message": query}
+    return {"thread_id": f"benchmark-{i}", "queries": [query]}
+
+
+def run_benchmark(workers: int, port: int, path: str, requests: int, concurrency: int,
+                  startup_timeout: float) -> None:
+    server = subprocess.Popen([
+        sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1",
+        "--port", str(port), "--worker-base-port", str(port + 1)
+    ])
+    try:
+        health = wait_until_ready(port, server, startup_timeout)
+        # Warm up the workers before timing
+        for i in range(workers * 2):
+            request(port, "POST", path, make_payload(path, i))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda i: request(port, "POST", path, make_payload(path, i)), range(requests)))
+        rps = requests / (time.perf_counter() - start)
+
+        pids = [health["pid"]] + [worker["pid"] for worker in health["workers"]]
+        rss, pss = map(sum, zip(*(read_memory_kb(pid) for pid in pids)))
+        print(f"workers={workers:<2}: {rps:8.1f} requests/s  RSS {rss / 1024:8.1f} MB  PSS {pss / 1024:8.1f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to test")
+    parser.add_argument("--path", default="/retrieve", choices=["/retrieve", "/chat"], help="Endpoint to load")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per worker count")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--port", type=int, default=8600, help="Port of the server under test")
+    parser.add_argument("--startup-timeout", type=float, default=300.0, help="Seconds to wait for the server")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        run_benchmark(workers, args.port, args.path, args.requests, args.concurrency, args.startup_timeout)
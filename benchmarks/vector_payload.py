@@ -0,0 +1,107 @@
+"""Compares the query response payload of the vector index with the sentence text in
+the vector metadata against the slim ID-only response plus local text hydration.
+
+For a response of --top-k matches it reports the JSON payload size and the decode
+time per query, and the time to hydrate the texts from the sentence store (cold,
+from SQLite, and warm, from its in-memory cache). With --live it also times real
+queries of the configured vector index with and without metadata.
+
+Run from the repository root:
+    python -m benchmarks.vector_payload --top-k 50
+    python -m benchmarks.vector_payload --live
+"""
+
+import os
+import glob
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from utils.configs import POLICY_DOCS_JSON_DIR, PINECONE_INDEX_NAME, EMBEDDING_DIMS
+from utils.common import iter_jsonl_records
+from utils.policy_ingestion import generate_id_for_text
+from utils import sentence_store
+
+INTENTS = ["return", "refund", "exchange", "damaged item"]
+
+
+def load_texts(count: int) -> list:
+    """The parsed policy sentences if there are enough of them, else synthetic ones of
+    a similar length."""
+    texts = []
+    for jsonl_file_path in glob.glob(os.path.join(POLICY_DOCS_JSON_DIR, "*.jsonl")):
+        for record in iter_jsonl_records(jsonl_file_path):
+            texts.extend(record.get("summary", []))
+    texts = list(dict.fromkeys(texts))
+    if len(texts) >= count:
+        return texts[:count]
+    rng = random.Random(0)
+    words = "return refund exchange item order days shipping policy customer within eligible sale".split()
+    return [" ".join(rng.choice(words) for _ in range(20)) + f" {i}." for i in range(count)]
+
+
+def time_decode(payload: bytes, runs: int) -> float:
+    start = time.perf_counter()
+    for _ in range(runs):
+        json.loads(payload)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def run_offline(top_k: int, runs: int) -> None:
+    texts = load_texts(top_k)
+    ids = [generate_id_for_text(text) for text in texts]
+    full = {"matches": [
+        {"id": i, "score": 0.5, "metadata": {"text": t, "intents": INTENTS[:2]}} for i, t in zip(ids, texts)
+    ]}
+    slim = {"matches": [{"id": i, "score": 0.5} for i in ids]}
+    full_payload, slim_payload = json.dumps(full).encode(), json.dumps(slim).encode()
+
+    print(f"with text metadata : {len(full_payload):8d} bytes  decode {time_decode(full_payload, runs):.3f}ms")
+    print(f"IDs only           : {len(slim_payload):8d} bytes  decode {time_decode(slim_payload, runs):.3f}ms")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "sentences.db")
+        sentence_store.init_sentence_store(db_path)
+        sentence_store.save_sentences([{"id": i, "text": t} for i, t in zip(ids, texts)], db_path)
+        cold = 0.0
+        for _ in range(runs):
+            sentence_store._text_cache.clear()
+            start = time.perf_counter()
+            sentence_store.get_sentence_texts(ids, db_path)
+            cold += time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(runs):
+            sentence_store.get_sentence_texts(ids, db_path)
+        warm = time.perf_counter() - start
+    print(f"hydration          : cold {cold / runs * 1000:.3f}ms  warm {warm / runs * 1000:.3f}ms")
+
+
+def run_live(top_k: int, runs: int) -> None:
+    from dotenv import load_dotenv
+    from utils.configs import ENV_FILE_PATH
+    from utils.vector_store import create_or_load_vector_index
+
+    load_dotenv(ENV_FILE_PATH)
+    index = create_or_load_vector_index(PINECONE_INDEX_NAME, EMBEDDING_DIMS, readonly=True)
+    rng = random.Random(0)
+    vectors = [[rng.gauss(0, 1) for _ in range(EMBEDDING_DIMS)] for _ in range(runs)]
+    for include_metadata in (True, False):
+        start = time.perf_counter()
+        for vector in vectors:
+            index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, include_values=False)
+        elapsed = (time.perf_counter() - start) / runs * 1000
+        print(f"live query, include_metadata={include_metadata!s:<5}: {elapsed:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=50, help="Matches per query response")
+    parser.add_argument("--runs", type=int, default=200, help="Repetitions per measurement")
+    parser.add_argument("--live", action="store_true", help="Also time queries of the configured vector index")
+    args = parser.parse_args()
+
+    run_offline(args.top_k, args.runs)
+    if args.live:
+        run_live(args.top_k, min(args.runs, 50))
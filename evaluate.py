@@ -0,0 +1,142 @@
+"""Bulk evaluation CLI of the chatbot, for regression testing policy and prompt changes
+over scripted conversations.
+
+Every conversation of the input JSONL file runs through the compiled graph in its
+own thread ID, several conversations in parallel. When the bot asks to confirm the
+return authorization, the conversation's "confirm" answer (or --confirm) is sent
+right away. The answers, tool calls and timings of every conversation are written
+to the output JSONL file as the conversations finish.
+
+Input, one conversation per line:
+    {"id": "return-final-sale", "turns": ["I want to return order 45673"], "confirm": "no"}
+
+Output, one line per conversation:
+    {"id": ..., "thread_id": ..., "seconds": ..., "error": null,
+     "turns": [{"message": ..., "response": ..., "auto_confirmation": ...,
+                "tool_calls": [{"name": ..., "args": ..., "output": ...}], "seconds": ...}]}
+
+Run from the repository root:
+    python evaluate.py conversations.jsonl results.jsonl --concurrency 8
+"""
+
+import json
+import time
+import uuid
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, ToolMessage
+
+from utils import metrics
+from utils.agent_utils import create_primary_assistant_runnable_and_build_graph, run_chat_turn
+from utils.common import iter_jsonl_records
+from utils.tool_cache import tool_result_cache
+from utils.configs import ENV_FILE_PATH
+
+
+def get_tool_calls(messages: list) -> list:
+    """Pairs the tool calls of the assistant messages with the outputs of the tools."""
+    tool_calls = {}
+    for message in messages:
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls:
+                tool_calls[tool_call["id"]] = {"name": tool_call["name"], "args": tool_call["args"], "output": None}
+        elif isinstance(message, ToolMessage) and message.tool_call_id in tool_calls:
+            tool_calls[message.tool_call_id]["output"] = message.content
+    return list(tool_calls.values())
+
+
+def run_turn(graph, config: dict, message: str, confirm: str) -> dict:
+    """Runs one scripted turn, answering the confirmation question if the bot asks it."""
+    message_count = len(graph.get_state(config).values.get("messages", []))
+    start = time.perf_counter()
+    response, awaiting_confirmation = run_chat_turn(graph, config, message)
+    auto_confirmation = None
+    if awaiting_confirmation:
+        auto_confirmation = confirm
+        response, _ = run_chat_turn(graph, config, confirm)
+    seconds = time.perf_counter() - start
+    metrics.observe("evaluate.turn", seconds)
+    new_messages = graph.get_state(config).values.get("messages", [])[message_count:]
+    return {
+        "message": message,
+        "response": response,
+        "auto_confirmation": auto_confirmation,
+        "tool_calls": get_tool_calls(new_messages),
+        "seconds": round(seconds, 3),
+    }
+
+
+def release_thread(graph, thread_id: str) -> None:
+    """Frees the memory of a finished conversation: its cached tool results and, where
+    the checkpointer supports it, its checkpoints."""
+    tool_result_cache.clear_thread(thread_id)
+    delete_thread = getattr(graph.checkpointer, "delete_thread", None)
+    if delete_thread is not None:
+        delete_thread(thread_id)
+
+
+def run_conversation(graph, conversation: dict, run_id: str, default_confirm: str) -> dict:
+    """Runs all the turns of a conversation in a thread ID of its own."""
+    conversation_id = conversation.get("id", conversation["line_no"])
+    thread_id = f"eval-{run_id}-{conversation['line_no']}"
+    config = {"configurable": {"thread_id": thread_id}}
+    result = {"id": conversation_id, "thread_id": thread_id, "turns": [], "error": None}
+    start = time.perf_counter()
+    try:
+        for message in conversation["turns"]:
+            result["turns"].append(run_turn(graph, config, message, conversation.get("confirm", default_confirm)))
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    release_thread(graph, thread_id)
+    return result
+
+
+def evaluate(input_path: str, output_path: str, concurrency: int, default_confirm: str, limit: int) -> None:
+    load_dotenv(ENV_FILE_PATH)
+    graph = create_primary_assistant_runnable_and_build_graph()
+    conversations = list(itertools.islice(iter_jsonl_records(input_path), limit))
+    # Thread IDs unique to this run, so conversations never share state across runs
+    run_id = uuid.uuid4().hex[:8]
+    errors = 0
+
+    start = time.perf_counter()
+    with open(output_path, "w") as f, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(run_conversation, graph, conversation, run_id, default_confirm)
+            for conversation in conversations
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            errors += result["error"] is not None
+            f.write(json.dumps(result, default=str) + "\n")
+            f.flush()
+            if done % 100 == 0:
+                print(f"{done}/{len(conversations)} conversations done")
+    elapsed = time.perf_counter() - start
+
+    turn_seconds = [
+        turn["seconds"] for line in iter_jsonl_records(output_path) for turn in line["turns"]
+    ]
+    print(f"Ran {len(conversations)} conversations ({len(turn_seconds)} turns, {errors} with errors) "
+          f"in {elapsed:.1f}s, {len(conversations) / elapsed:.2f} conversations/s")
+    if turn_seconds:
+        p50, p95 = np.percentile(turn_seconds, [50, 95])
+        print(f"Turn latency: p50 {p50:.2f}s, p95 {p95:.2f}s")
+    metrics.print_metrics()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file with the scripted conversations")
+    parser.add_argument("output", help="JSONL file to write the results to")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversations run in parallel")
+    parser.add_argument("--confirm", default="yes",
+                        help="Answer to the return authorization question, unless a conversation sets its own")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of conversations to run")
+    args = parser.parse_args()
+    evaluate(args.input, args.output, args.concurrency, args.confirm, args.limit)
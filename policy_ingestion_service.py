@@ -1,17 +1,32 @@
 """This is the main file for the Policy Ingestion Service. It is responsible for
-ingesting policies from a given source and storing them in the database every hour."""
+ingesting policies from a given source and storing them in the database every hour.
 
-from utils.policy_parsing import (
-    check_file_processed,
-    process_pdf_file,
-)
+Every policy document is a job in the database. Several worker processes can share
+the jobs, and a job interrupted by a crash is resumed from its unfinished work."""
+
+from utils.policy_parsing import process_pdf_file
 from utils.policy_ingestion import (
-    get_files_to_process,
-    update_database_status,
     collate_json_data,
-    create_or_load_pinecone_index,
     process_and_upsert_data
 )
+from utils.vector_store import create_or_load_vector_index
+from utils.embedding_service import get_embedding_service
+from utils.sentence_store import init_sentence_store, count_sentences, save_sentences
+from utils.intent_classifier import (
+    is_intent_classifier_stale,
+    train_intent_classifier
+)
+from utils.ingestion_jobs import (
+    PARSING, PARSED, INDEXING, INDEXED,
+    JobProgress,
+    LeaseLostError,
+    init_job_tables,
+    register_jobs,
+    claim_next_job,
+    fail_job,
+    count_unfinished_jobs,
+    get_worker_id
+)
 from utils.configs import (
     POLICY_DOCS_DIR,
     POLICY_DOCS_JSON_DIR,
@@ -20,47 +35,126 @@ from utils.configs import (
     ENV_FILE_PATH,
     EMBEDDING_MODEL_NAME,
     EMBEDDING_DIMS,
-    PINECONE_INDEX_NAME
+    PINECONE_INDEX_NAME,
+    INGESTION_WORKERS,
+    INGESTION_DRAIN_CHECK_INTERVAL
+)
+from utils.common import (
+    load_embedding_model,
+    get_jsonl_file_path,
+    iter_jsonl_records
 )
-from utils.common import load_embedding_model
 
 import os
+import glob
 import json
 import time
+import argparse
+import multiprocessing
 from dotenv import load_dotenv
 
-def parse_policy_documents(input_dir, db_path, json_output_dir):
-  """Parses policy documents from the input directory and saves the JSON output."""
-  for filename in os.listdir(input_dir):
-      if filename.endswith(".pdf"):
-          file_processed_flag = check_file_processed(filename, db_path)
-          if not file_processed_flag:
-              print(f"Processing file: {filename}")
-              pdf_file_path = os.path.join(input_dir, filename)
-              json_responses = process_pdf_file(pdf_file_path, db_path, json_output_dir)
-              if len(json_responses) > 0:
-                  print(f"Processed file: {filename}, {len(json_responses)} JSON record(s) saved.")
+def parse_policy_document(filename, input_dir, json_output_dir, progress):
+  """Parses one policy document into its JSONL file, skipping the subsections done earlier."""
+  progress.set_stage(PARSING)
+  print(f"Processing file: {filename}")
+  pdf_file_path = os.path.join(input_dir, filename)
+  records_count = process_pdf_file(pdf_file_path, json_output_dir, progress)
+  progress.check_stage_complete('subsection')
+  if records_count > 0:
+      print(f"Processed file: {filename}, {records_count} JSON record(s) saved.")
+  # The upload batches follow the JSONL file, which may have changed
+  progress.reset_tasks('batch')
+  progress.set_stage(PARSED)
 
-def upload_policy_to_pinecone(input_dir, db_path):
-    """Uploads JSON policy data to Pinecone index."""
-    filenames = get_files_to_process(db_path)
-    for filename in filenames:
-        json_file = os.path.splitext(filename)[0] + '.json'
-        json_file_path = os.path.join(input_dir, json_file)
+def upload_policy_to_pinecone(filename, input_dir, progress):
+    """Streams the JSONL policy data of one document to the vector index, skipping the
+    batches uploaded earlier."""
+    progress.set_stage(INDEXING)
+    jsonl_file_path = get_jsonl_file_path(filename, input_dir)
+    if os.path.exists(jsonl_file_path):
+        collated_data = collate_json_data(iter_jsonl_records(jsonl_file_path))
+        index = create_or_load_vector_index(PINECONE_INDEX_NAME, EMBEDDING_DIMS)
+        model = get_embedding_service(EMBEDDING_MODEL_NAME)
+        process_and_upsert_data(index, collated_data, model, progress=progress)
+        progress.check_stage_complete('batch')
+    progress.set_stage(INDEXED)
 
-        if os.path.exists(json_file_path):
-            with open(json_file_path, 'r') as f:
-                data = json.load(f)
+def run_pending_jobs(input_dir, db_path, json_output_dir, worker_id):
+  """Claims and runs jobs until no job is left for this worker."""
+  while True:
+      job = claim_next_job(db_path, worker_id)
+      if job is None:
+          return
+      filename, stage = job
+      progress = JobProgress(db_path, filename, worker_id)
+      try:
+          if stage not in (PARSED, INDEXING):
+              parse_policy_document(filename, input_dir, json_output_dir, progress)
+          upload_policy_to_pinecone(filename, json_output_dir, progress)
+      except LeaseLostError as e:
+          print(f"Stopped working on {filename}: {e}")
+      except Exception as e:
+          print(f"Error ingesting {filename}, will resume later: {e}")
+          fail_job(db_path, filename, worker_id, str(e))
 
-            collated_data = collate_json_data(data)
-            index = create_or_load_pinecone_index(PINECONE_INDEX_NAME, EMBEDDING_DIMS)
-            model = load_embedding_model(EMBEDDING_MODEL_NAME)
-            process_and_upsert_data(index, collated_data, model)
-            update_database_status(db_path, filename, 'index updated')
-  
-if __name__ == "__main__":
+def update_intent_classifier(json_output_dir):
+  """Retrains the query intent classifier when the parsed policies changed."""
+  if is_intent_classifier_stale(json_output_dir):
+      train_intent_classifier(json_output_dir, load_embedding_model(EMBEDDING_MODEL_NAME))
+
+def backfill_sentence_store(json_output_dir, db_path):
+  """Fills the sentence store from the parsed policies, for vectors upserted while their
+  texts were still kept in the vector metadata. Covers the JSONL files and the JSON files
+  of the earlier parser, whose documents are already indexed and never parsed again."""
+  init_sentence_store(db_path)
+  sentences_count = count_sentences(db_path)
+  for jsonl_file_path in glob.glob(os.path.join(json_output_dir, "*.jsonl")):
+      save_sentences(collate_json_data(iter_jsonl_records(jsonl_file_path)), db_path)
+  for json_file_path in glob.glob(os.path.join(json_output_dir, "*.json")):
+      with open(json_file_path, "r") as f:
+          save_sentences(collate_json_data(json.load(f)), db_path)
+  added_count = count_sentences(db_path) - sentences_count
+  if added_count > 0:
+      print(f"Added {added_count} sentence(s) to the sentence store from {json_output_dir}")
+
+def run_worker(input_dir, db_path, json_output_dir):
+  """Runs the ingestion jobs once and subsequently every hour, continuously. The intent
+  classifier is retrained by the parent process, see retrain_after_jobs_drain."""
   load_dotenv(ENV_FILE_PATH)
+  worker_id = get_worker_id()
   while True:
-      parse_policy_documents(POLICY_DOCS_DIR, DB_PATH, POLICY_DOCS_JSON_DIR)
-      upload_policy_to_pinecone(POLICY_DOCS_JSON_DIR, DB_PATH)
+      try:
+          register_jobs(db_path, [f for f in os.listdir(input_dir) if f.endswith(".pdf")])
+          run_pending_jobs(input_dir, db_path, json_output_dir, worker_id)
+      except Exception as e:
+          print(f"Error in ingestion worker {worker_id}: {e}")
       time.sleep(SLEEP_TIME)
+
+def retrain_after_jobs_drain(workers, db_path, json_output_dir):
+  """Retrains the intent classifier whenever no job is left unfinished, until the workers
+  exit. It runs in the parent process, so it is trained once per change of the parsed
+  policies rather than by every worker."""
+  while any(worker.is_alive() for worker in workers):
+      time.sleep(INGESTION_DRAIN_CHECK_INTERVAL)
+      try:
+          if count_unfinished_jobs(db_path) == 0:
+              update_intent_classifier(json_output_dir)
+      except Exception as e:
+          print(f"Error updating the intent classifier: {e}")
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Policy ingestion service")
+  parser.add_argument("--workers", type=int, default=INGESTION_WORKERS, help="Number of worker processes")
+  args = parser.parse_args()
+
+  init_job_tables(DB_PATH)
+  backfill_sentence_store(POLICY_DOCS_JSON_DIR, DB_PATH)
+  workers = [
+      multiprocessing.Process(target=run_worker, args=(POLICY_DOCS_DIR, DB_PATH, POLICY_DOCS_JSON_DIR))
+      for _ in range(args.workers)
+  ]
+  for worker in workers:
+      worker.start()
+  retrain_after_jobs_drain(workers, DB_PATH, POLICY_DOCS_JSON_DIR)
+  for worker in workers:
+      worker.join()
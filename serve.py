@@ -0,0 +1,267 @@
+"""Multi-worker HTTP serving mode of the chatbot.
+
+The embedding model, intent classifier and vector index clients are loaded once in
+the parent process, which then forks the workers, so their memory pages are shared
+copy-on-write instead of loaded again by every worker. The parent serves the public
+HTTP port and forwards each request to a worker chosen by its thread ID, as the
+conversation state of a thread lives in the memory of the worker that runs it.
+A worker which dies is forked again on the same port.
+
+Endpoints:
+    POST /chat      {"thread_id": "...", "message": "..."}
+                    -> {"response": "...", "awaiting_confirmation": false}
+    POST /retrieve  {"thread_id": "...", "queries": ["..."]}
+                    -> {"policies": [[...]], "errors": [null, ...]}
+    GET  /health    -> {"pid": ..., "workers": [...]}
+
+Run from the repository root:
+    python serve.py --workers 4 --port 8000
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import zlib
+import signal
+import argparse
+import threading
+import http.client
+import multiprocessing
+import multiprocessing.connection
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from dotenv import load_dotenv
+
+# Loads the embedding model and the vector index clients once, in the parent process
+from utils.agent_tools import retrieve_relevant_policies_by_queries
+from utils.agent_utils import create_primary_assistant_runnable_and_build_graph, run_chat_turn
+from utils.intent_classifier import get_intent_classifier
+from utils.configs import (
+    ENV_FILE_PATH,
+    SERVE_HOST,
+    SERVE_PORT,
+    SERVE_WORKERS,
+    SERVE_WORKER_BASE_PORT,
+    SERVE_WORKER_THREADS,
+    SLIM_SERVING_EXCLUDED_MODULES
+)
+
+
+class JSONRequestHandler(BaseHTTPRequestHandler):
+    """Request handler with JSON bodies."""
+
+    protocol_version = "HTTP/1.1"
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Request logs of every worker would flood the console
+        pass
+
+
+class WorkerHandler(JSONRequestHandler):
+    """Runs the chat turns and retrievals of one worker process."""
+
+    @contextmanager
+    def thread_lock(self, thread_id):
+        """Serializes the chat turns of a conversation thread, whose checkpoints would
+        otherwise be written by concurrent turns. Locks are dropped once unused."""
+        with self.server.thread_locks_guard:
+            lock, users = self.server.thread_locks.get(thread_id, (threading.Lock(), 0))
+            self.server.thread_locks[thread_id] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self.server.thread_locks_guard:
+                lock, users = self.server.thread_locks[thread_id]
+                if users == 1:
+                    del self.server.thread_locks[thread_id]
+                else:
+                    self.server.thread_locks[thread_id] = (lock, users - 1)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"pid": os.getpid()})
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        try:
+            request = self.read_json()
+            if self.path == "/chat":
+                thread_id = str(request["thread_id"])
+                config = {"configurable": {"thread_id": thread_id}}
+                with self.thread_lock(thread_id):
+                    response, awaiting_confirmation = run_chat_turn(self.server.graph, config, request["message"])
+                self.send_json(200, {"response": response, "awaiting_confirmation": awaiting_confirmation})
+            elif self.path == "/retrieve":
+                policies, errors = retrieve_relevant_policies_by_queries(request["queries"])
+                self.send_json(200, {"policies": policies, "errors": errors})
+            else:
+                self.send_json(404, {"error": "Not found"})
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": f"Invalid request: {e}"})
+        except Exception as e:
+            print(f"Error in worker {os.getpid()}: {e}")
+            self.send_json(500, {"error": str(e)})
+
+
+class DispatcherHandler(JSONRequestHandler):
+    """Forwards every request to the worker owning its conversation thread."""
+
+    def get_connection(self, port):
+        # One keep-alive connection per dispatcher thread and worker
+        connections = getattr(self.server.local, "connections", None)
+        if connections is None:
+            connections = self.server.local.connections = {}
+        if port not in connections:
+            connections[port] = http.client.HTTPConnection("127.0.0.1", port)
+        return connections[port]
+
+    def forward(self, port, method, body=None):
+        connection = self.get_connection(port)
+        try:
+            connection.request(method, self.path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "Not found"})
+            return
+        workers = []
+        for port in self.server.worker_ports:
+            # A dead or restarting worker is reported in its own entry
+            try:
+                workers.append(self.forward(port, "GET")[1])
+            except (http.client.HTTPException, OSError, ValueError) as e:
+                workers.append({"port": port, "error": str(e)})
+        self.send_json(200, {"pid": os.getpid(), "workers": workers})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        try:
+            thread_id = str(json.loads(body)["thread_id"])
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": f"Invalid request: {e}"})
+            return
+        # A stable hash, so a thread always goes to the same worker
+        port = self.server.worker_ports[zlib.crc32(thread_id.encode()) % len(self.server.worker_ports)]
+        try:
+            self.send_json(*self.forward(port, "POST", body))
+        except (http.client.HTTPException, OSError) as e:
+            self.send_json(502, {"error": f"Worker unavailable: {e}"})
+
+
+def preload_shared_state():
+    """Loads the rest of the shared state in the parent process, before the workers
+    fork. The loaded objects are moved out of the garbage collector's reach, so
+    collections in the workers do not write to (and so copy) their shared memory pages."""
+    get_intent_classifier()
+    # Every module loaded here is resident in each worker, the ingestion code is not needed
+    loaded = [name for name in SLIM_SERVING_EXCLUDED_MODULES if name in sys.modules]
+    if loaded:
+        print(f"Warning: the chat path imported {', '.join(loaded)}, "
+              "run python -m benchmarks.memory_profile to find where")
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(port, torch_threads):
+    """Builds the chat graph and serves the requests forwarded to this worker."""
+    torch.set_num_threads(torch_threads)
+    server = ThreadingHTTPServer(("127.0.0.1", port), WorkerHandler)
+    server.graph = create_primary_assistant_runnable_and_build_graph()
+    server.thread_locks = {}
+    server.thread_locks_guard = threading.Lock()
+    print(f"Worker {os.getpid()} listening on port {port}")
+    server.serve_forever()
+
+
+def supervise_workers(processes, worker_ports, start_worker, stopping):
+    """Waits for the workers to exit and forks a new one on the port of every worker
+    that died (ex - killed out of memory), until stopping is set."""
+    while not stopping.is_set():
+        sentinels = {process.sentinel: i for i, process in enumerate(processes)}
+        exited = multiprocessing.connection.wait(list(sentinels), timeout=1.0)
+        if stopping.is_set():
+            return
+        for sentinel in exited:
+            i = sentinels[sentinel]
+            processes[i].join()
+            print(f"Worker {processes[i].pid} on port {worker_ports[i]} exited with code "
+                  f"{processes[i].exitcode}, restarting it")
+            processes[i] = start_worker(worker_ports[i])
+        if exited:
+            # Keeps a worker which crashes on startup from being re-forked in a busy loop
+            time.sleep(1.0)
+
+
+def serve(host, port, workers, worker_base_port):
+    load_dotenv(ENV_FILE_PATH)
+    preload_shared_state()
+
+    torch_threads = SERVE_WORKER_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    worker_ports = [worker_base_port + i for i in range(workers)]
+    # Fork (not spawn), so the workers share the models loaded above
+    context = multiprocessing.get_context("fork")
+
+    def start_worker(worker_port):
+        process = context.Process(target=run_worker, args=(worker_port, torch_threads), daemon=True)
+        process.start()
+        return process
+
+    processes = [start_worker(worker_port) for worker_port in worker_ports]
+    stopping = threading.Event()
+    supervisor = threading.Thread(
+        target=supervise_workers, args=(processes, worker_ports, start_worker, stopping), daemon=True
+    )
+    supervisor.start()
+
+    server = ThreadingHTTPServer((host, port), DispatcherHandler)
+    server.worker_ports = worker_ports
+    server.local = threading.local()
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"Serving on {host}:{port} with {workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopping.set()
+        supervisor.join()
+        server.server_close()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVE_HOST, help="Host of the public HTTP port")
+    parser.add_argument("--port", type=int, default=SERVE_PORT, help="Public HTTP port")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Number of worker processes")
+    parser.add_argument("--worker-base-port", type=int, default=SERVE_WORKER_BASE_PORT,
+                        help="Workers listen on localhost, from this port onwards")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.worker_base_port)
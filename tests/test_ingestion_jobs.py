@@ -0,0 +1,127 @@
+"""Tests of the job leases and the resumable tasks of the policy ingestion service."""
+
+import pytest
+
+from utils import ingestion_jobs
+from utils.ingestion_jobs import (
+    JobProgress,
+    LeaseLostError,
+    IncompleteStageError,
+    connect,
+    init_job_tables,
+    register_jobs,
+    claim_next_job,
+    fail_job,
+    count_unfinished_jobs,
+)
+from utils.configs import INGESTION_JOBS_TABLE_NAME
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    init_job_tables(path)
+    register_jobs(path, ["a.pdf"])
+    return path
+
+
+def expire_lease(db_path, filename):
+    with connect(db_path) as conn:
+        conn.execute(
+            f"UPDATE {INGESTION_JOBS_TABLE_NAME} SET lease_expires = 0 WHERE filename = ?", (filename,)
+        )
+
+
+def read_job(db_path, filename):
+    with connect(db_path) as conn:
+        return conn.execute(
+            f"SELECT stage, attempts, lease_owner FROM {INGESTION_JOBS_TABLE_NAME} WHERE filename = ?",
+            (filename,)
+        ).fetchone()
+
+
+def test_leased_job_is_not_claimed_twice(db_path):
+    assert claim_next_job(db_path, "worker-a") == ("a.pdf", ingestion_jobs.PENDING)
+    assert claim_next_job(db_path, "worker-b") is None
+
+
+def test_expired_lease_is_taken_over(db_path):
+    claim_next_job(db_path, "worker-a")
+    old_owner = JobProgress(db_path, "a.pdf", "worker-a")
+    old_owner.set_stage(ingestion_jobs.PARSING)
+    expire_lease(db_path, "a.pdf")
+
+    assert claim_next_job(db_path, "worker-b") == ("a.pdf", ingestion_jobs.PARSING)
+    assert read_job(db_path, "a.pdf") == (ingestion_jobs.PARSING, 2, "worker-b")
+    with pytest.raises(LeaseLostError):
+        old_owner.renew_lease()
+    with pytest.raises(LeaseLostError):
+        old_owner.set_stage(ingestion_jobs.PARSED)
+    with pytest.raises(LeaseLostError):
+        old_owner.complete_task("parse", "0")
+    # The new owner keeps working on the job
+    JobProgress(db_path, "a.pdf", "worker-b").set_stage(ingestion_jobs.PARSED)
+
+
+def test_finished_tasks_are_skipped_on_resume(db_path):
+    claim_next_job(db_path, "worker-a")
+    progress = JobProgress(db_path, "a.pdf", "worker-a")
+    progress.register_tasks("parse", ["0", "1", "2"])
+    progress.complete_task("parse", "0")
+    progress.complete_task("parse", "1")
+    expire_lease(db_path, "a.pdf")
+
+    claim_next_job(db_path, "worker-b")
+    resumed = JobProgress(db_path, "a.pdf", "worker-b")
+    # Registering the tasks again keeps their state
+    resumed.register_tasks("parse", ["0", "1", "2"])
+    assert [key for key in ["0", "1", "2"] if not resumed.is_task_finished("parse", key)] == ["2"]
+    with pytest.raises(IncompleteStageError):
+        resumed.check_stage_complete("parse")
+    resumed.complete_task("parse", "2")
+    resumed.check_stage_complete("parse")
+
+
+def test_task_fails_for_good_after_max_attempts(db_path, monkeypatch):
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_MAX_TASK_ATTEMPTS", 2)
+    claim_next_job(db_path, "worker-a")
+    progress = JobProgress(db_path, "a.pdf", "worker-a")
+    progress.register_tasks("index", ["0"])
+    progress.fail_task("index", "0", "timeout")
+    assert not progress.is_task_finished("index", "0")
+    progress.fail_task("index", "0", "timeout")
+    assert progress.is_task_finished("index", "0")
+    # A task which failed for good does not hold the stage back
+    progress.check_stage_complete("index")
+
+
+def test_failed_job_is_retried_until_max_attempts(db_path, monkeypatch):
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_MAX_JOB_ATTEMPTS", 2)
+    claim_next_job(db_path, "worker-a")
+    fail_job(db_path, "a.pdf", "worker-a", "parser crashed")
+    assert read_job(db_path, "a.pdf") == (ingestion_jobs.PENDING, 1, None)
+
+    assert claim_next_job(db_path, "worker-b") == ("a.pdf", ingestion_jobs.PENDING)
+    fail_job(db_path, "a.pdf", "worker-b", "parser crashed")
+    assert read_job(db_path, "a.pdf") == (ingestion_jobs.FAILED, 2, None)
+    assert claim_next_job(db_path, "worker-a") is None
+
+
+def test_fail_job_of_a_lost_lease_is_ignored(db_path):
+    claim_next_job(db_path, "worker-a")
+    expire_lease(db_path, "a.pdf")
+    claim_next_job(db_path, "worker-b")
+    fail_job(db_path, "a.pdf", "worker-a", "late error")
+    assert read_job(db_path, "a.pdf")[2] == "worker-b"
+
+
+def test_jobs_drain_once_indexed_or_failed(db_path, monkeypatch):
+    monkeypatch.setattr(ingestion_jobs, "INGESTION_MAX_JOB_ATTEMPTS", 1)
+    register_jobs(db_path, ["b.pdf"])
+    assert count_unfinished_jobs(db_path) == 2
+    claim_next_job(db_path, "worker-a")
+    JobProgress(db_path, "a.pdf", "worker-a").set_stage(ingestion_jobs.INDEXED)
+    assert count_unfinished_jobs(db_path) == 1
+    claim_next_job(db_path, "worker-a")
+    fail_job(db_path, "b.pdf", "worker-a", "parser crashed")
+    assert count_unfinished_jobs(db_path) == 0
@@ -0,0 +1,112 @@
+"""Tests of the return, exchange and damage report eligibility of the orders view."""
+
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from utils import order_eligibility
+from utils.order_eligibility import create_eligibility_view, eligibility_view_exists
+from utils.configs import ORDER_ELIGIBILITY_VIEW_NAME
+
+TABLE_NAME = "orders"
+COLUMNS = (
+    "order_id, product_category, product_name, size, quantity, `price_(usd)`, order_date, status, "
+    "payment_method, shipping_address, final_sale, order_date_iso, order_epoch_day, is_final_sale, status_code"
+)
+
+
+@pytest.fixture(autouse=True)
+def windows(monkeypatch):
+    # Distinct windows, so every column is checked against its own
+    monkeypatch.setattr(order_eligibility, "RETURN_WINDOW_DAYS", 30)
+    monkeypatch.setattr(order_eligibility, "EXCHANGE_WINDOW_DAYS", 45)
+    monkeypatch.setattr(order_eligibility, "DAMAGE_REPORT_WINDOW_DAYS", 7)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "orders.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"CREATE TABLE {TABLE_NAME} ({COLUMNS})")
+    return path
+
+
+def add_order(db_path, order_id, days_ago, status="Delivered", final_sale="No", derived=True):
+    """Adds an order placed days_ago days ago. Without derived, the derived columns are
+    left empty, as in a table not yet updated by the order data service."""
+    order_date = date.today() - timedelta(days=days_ago)
+    is_final_sale = int(final_sale.strip().lower() in ("yes", "true", "1"))
+    status_code = status.lower() if status.lower() in ("delivered", "shipped", "processing") else "unknown"
+    values = (
+        order_id, "Shoes", "Runner", "42", 1, 99.0, order_date.isoformat(), status, "Card", "Main St",
+        final_sale,
+        order_date.isoformat() if derived else None,
+        (order_date - date(1970, 1, 1)).days if derived else None,
+        is_final_sale if derived else None,
+        status_code if derived else None,
+    )
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(f"INSERT INTO {TABLE_NAME} ({COLUMNS}) VALUES ({', '.join('?' * len(values))})", values)
+
+
+def read_eligibility(db_path, order_id):
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        create_eligibility_view(cursor, TABLE_NAME)
+        conn.row_factory = sqlite3.Row
+        row = conn.execute(
+            f"SELECT * FROM {ORDER_ELIGIBILITY_VIEW_NAME} WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        return dict(row)
+
+
+@pytest.mark.parametrize("derived", [True, False])
+@pytest.mark.parametrize("days_ago, returnable, exchangeable, damage_reportable", [
+    (0, 1, 1, 1),
+    (7, 1, 1, 1),
+    (8, 1, 1, 0),
+    (30, 1, 1, 0),
+    (31, 0, 1, 0),
+    (45, 0, 1, 0),
+    (46, 0, 0, 0),
+])
+def test_windows_of_delivered_orders(db_path, derived, days_ago, returnable, exchangeable, damage_reportable):
+    add_order(db_path, "A1", days_ago, derived=derived)
+    row = read_eligibility(db_path, "A1")
+    assert row["days_since_order"] == days_ago
+    assert (row["return_eligible"], row["exchange_eligible"], row["damage_report_eligible"]) == (
+        returnable, exchangeable, damage_reportable
+    )
+    assert row["days_left_to_return"] == (30 - days_ago if returnable else 0)
+    if returnable:
+        assert row["return_ineligibility_reason"] is None
+    else:
+        assert row["return_ineligibility_reason"] == "the 30 day return window has passed"
+
+
+@pytest.mark.parametrize("derived", [True, False])
+def test_final_sale_cannot_be_returned_or_exchanged(db_path, derived):
+    add_order(db_path, "F1", 3, final_sale=" Yes", derived=derived)
+    row = read_eligibility(db_path, "F1")
+    assert row["is_final_sale"] == 1
+    assert (row["return_eligible"], row["exchange_eligible"], row["damage_report_eligible"]) == (0, 0, 1)
+    assert row["days_left_to_return"] == 0
+    assert row["return_ineligibility_reason"] == "final sale items cannot be returned or exchanged"
+
+
+@pytest.mark.parametrize("derived", [True, False])
+@pytest.mark.parametrize("status, status_code", [("Shipped", "shipped"), ("Lost in transit", "unknown")])
+def test_undelivered_orders_are_not_eligible(db_path, derived, status, status_code):
+    add_order(db_path, "S1", 2, status=status, derived=derived)
+    row = read_eligibility(db_path, "S1")
+    assert row["status"] == status_code
+    assert (row["return_eligible"], row["exchange_eligible"], row["damage_report_eligible"]) == (0, 0, 0)
+    assert row["return_ineligibility_reason"] == f"order is not delivered yet (status: {status_code})"
+
+
+def test_view_exists_only_once_created(db_path):
+    assert not eligibility_view_exists(db_path)
+    add_order(db_path, "A1", 1)
+    read_eligibility(db_path, "A1")
+    assert eligibility_view_exists(db_path)
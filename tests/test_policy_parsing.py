@@ -0,0 +1,83 @@
+"""Tests of the chunk packing of the policy parsing, at the token budget."""
+
+import pytest
+
+pytest.importorskip("pymupdf4llm")
+pytest.importorskip("langchain_text_splitters")
+pytest.importorskip("langchain_groq")
+pytest.importorskip("pinecone")
+
+from utils import policy_parsing
+from utils.policy_parsing import (
+    count_tokens,
+    split_oversized_subsection,
+    pack_subsections_into_chunks,
+    render_chunk,
+)
+
+
+@pytest.fixture(params=["chars", "tiktoken"])
+def token_estimate(request, monkeypatch):
+    """Runs the test with the character estimate and, where it loads, with tiktoken."""
+    if request.param == "chars":
+        monkeypatch.setattr(policy_parsing, "get_token_encoding", lambda: None)
+    elif policy_parsing.get_token_encoding() is None:
+        pytest.skip("tiktoken is unavailable")
+    return request.param
+
+
+def make_sentences(count, words=8):
+    return " ".join(
+        " ".join(f"word{i}x{j}" for j in range(words)) + "." for i in range(count)
+    )
+
+
+def test_small_subsections_are_packed_up_to_the_target(token_estimate):
+    subsections = [(f"Policy > Part {i}", make_sentences(2)) for i in range(20)]
+    chunks = pack_subsections_into_chunks(subsections, target_tokens=200, max_tokens=300)
+    assert 1 < len(chunks) < len(subsections)
+    assert all(count_tokens(chunk) <= 200 for chunk in chunks)
+    # Every subsection is kept, in order, under its own section line
+    text = "\n".join(chunks)
+    assert [text.index(f"Policy > Part {i}\n") for i in range(20)] == sorted(
+        text.index(f"Policy > Part {i}\n") for i in range(20)
+    )
+
+
+def test_sections_are_numbered_per_chunk():
+    chunk = render_chunk([("Returns", "Return within 30 days."), ("", "Keep the receipt.")])
+    assert chunk.splitlines() == ["Section 1: Returns", "Return within 30 days.", "Section 2:",
+                                  "Keep the receipt."]
+
+
+def test_oversized_subsection_is_split_with_overlap(token_estimate):
+    text = make_sentences(40)
+    parts = split_oversized_subsection(text, target_tokens=100, overlap_sentences=1)
+    assert len(parts) > 1
+    assert all(count_tokens(part) <= 100 for part in parts)
+    for previous, part in zip(parts, parts[1:]):
+        last_sentence = previous.rsplit(". ", 1)[-1]
+        assert part.startswith(last_sentence)
+
+
+@pytest.mark.parametrize("overlap_sentences", [0, 1, 2])
+def test_sentence_longer_than_the_target_is_hard_split(token_estimate, overlap_sentences):
+    long_sentence = " ".join(f"clause{i}" for i in range(300)) + "."
+    text = f"{make_sentences(3)} {long_sentence} {make_sentences(3)}"
+    parts = split_oversized_subsection(text, target_tokens=50, overlap_sentences=overlap_sentences)
+    assert all(count_tokens(part) <= 50 for part in parts)
+    if overlap_sentences == 0:
+        # Nothing is lost or repeated, the splits only move the spaces
+        assert "".join(parts).replace(" ", "") == text.replace(" ", "")
+    assert any(part.startswith("clause0 ") for part in parts)
+    assert any(part.endswith("clause299.") for part in parts)
+
+
+def test_split_parts_fit_in_a_chunk_with_their_section_line(token_estimate):
+    long_sentence = " ".join(f"clause{i}" for i in range(500)) + "."
+    subsections = [("Policy > Damaged items > Reporting", f"{make_sentences(20)} {long_sentence}")]
+    chunks = pack_subsections_into_chunks(subsections, target_tokens=120, max_tokens=150,
+                                          overlap_sentences=1)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 120 for chunk in chunks)
+    assert all(chunk.startswith("Section 1: Policy > Damaged items > Reporting\n") for chunk in chunks)
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from utils.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    FaultInjector,
+    ResilientDependency,
+    hedged_call,
+    is_transient_error,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_breaker_opens_then_half_opens_then_closes():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # A single trial call is let through while half open
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_failed_trial_call_reopens_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.parametrize("error, transient", [
+    (ConnectionError(), True),
+    (TimeoutError(), True),
+    (StatusError(429), True),
+    (StatusError(503), True),
+    (StatusError(400), False),
+    (StatusError(401), False),
+    (ValueError("bad tool call"), False),
+])
+def test_transient_errors(error, transient):
+    assert is_transient_error(error) == transient
+
+
+def test_transient_errors_are_retried_and_open_the_circuit():
+    dependency = ResilientDependency("test", attempts=3, base_delay=0, max_delay=0, failure_threshold=1)
+    flaky = FaultInjector(failure_rate=1.0)
+    with pytest.raises(ConnectionError):
+        dependency.call(flaky)
+    assert flaky.calls == 3
+    assert dependency.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        dependency.call(flaky)
+    assert dependency.call(flaky, fallback=lambda: "fallback") == "fallback"
+    assert flaky.calls == 3
+
+
+def test_client_errors_are_not_retried_and_keep_the_circuit_closed():
+    dependency = ResilientDependency("test", attempts=3, base_delay=0, max_delay=0, failure_threshold=1)
+    bad_request = FaultInjector(failure_rate=1.0, error=lambda message: StatusError(400))
+    with pytest.raises(StatusError):
+        dependency.call(bad_request)
+    assert bad_request.calls == 1
+    assert dependency.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_recovers_from_a_transient_failure():
+    dependency = ResilientDependency("test", attempts=2, base_delay=0, max_delay=0)
+    calls = []
+
+    def flaky_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert dependency.call(flaky_once) == "ok"
+    assert len(calls) == 2
+
+
+def test_timeout_raises_and_counts_as_failure():
+    dependency = ResilientDependency("test", timeout=0.05, failure_threshold=1)
+    slow = FaultInjector(return_value="late", latency=0.5)
+    assert dependency.call(slow, fallback=lambda: "fallback") == "fallback"
+    assert dependency.breaker.state == CircuitBreaker.OPEN
+
+
+def test_hedged_call_returns_the_faster_attempt():
+    attempts = []
+
+    def slow_first():
+        attempts.append(1)
+        if len(attempts) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "hedge"
+
+    start = time.monotonic()
+    assert hedged_call(slow_first, 0.05, 2.0) == "hedge"
+    assert time.monotonic() - start < 0.4
+    assert len(attempts) == 2
+
+
+def test_hedged_call_does_not_hedge_fast_answers():
+    fast = FaultInjector(return_value="fast")
+    assert hedged_call(fast, 0.2, 1.0) == "fast"
+    assert fast.calls == 1
@@ -0,0 +1,99 @@
+import sqlite3
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from utils import tool_cache
+from utils.configs import ORDER_CHANGES_TABLE_NAME
+from utils.tool_cache import ToolResultCache, _MISS, make_cache_key
+
+ORDER_TOOL = "Get-Order-Details"
+POLICY_TOOL = "Get-Relevant-Policies-By-Query"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "chatbot.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"""
+            CREATE TABLE {ORDER_CHANGES_TABLE_NAME} (
+                change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER,
+                changed_at TEXT
+            )
+        """)
+    return path
+
+
+@pytest.fixture
+def cache(db_path, monkeypatch):
+    monkeypatch.setattr(tool_cache, "ORDER_CHANGES_POLL_INTERVAL", 0.0)
+    return ToolResultCache(
+        ttls={ORDER_TOOL: 300, POLICY_TOOL: 0.05},
+        daily_tools={"Get-Todays-Date"},
+        order_keyed_tools={ORDER_TOOL},
+        max_threads=2,
+        max_entries_per_thread=10,
+        db_path=db_path,
+    )
+
+
+def record_order_change(db_path, order_id):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            f"INSERT INTO {ORDER_CHANGES_TABLE_NAME} (order_id, changed_at) VALUES (?, '')", (order_id,)
+        )
+
+
+def test_order_change_invalidates_the_cached_order(cache, db_path):
+    key, other_key = make_cache_key((), {"order_id": 45673}), make_cache_key((), {"order_id": 45674})
+    # The first lookup notes the end of the change log
+    assert cache.get("thread", ORDER_TOOL, key) is _MISS
+    cache.put("thread", ORDER_TOOL, key, {"status": "shipped"})
+    cache.put("thread", ORDER_TOOL, other_key, {"status": "delivered"})
+    assert cache.get("thread", ORDER_TOOL, key) == {"status": "shipped"}
+
+    record_order_change(db_path, 45673)
+    assert cache.get("thread", ORDER_TOOL, key) is _MISS
+    assert cache.get("thread", ORDER_TOOL, other_key) == {"status": "delivered"}
+
+
+def test_changes_logged_before_the_first_poll_are_not_replayed(cache, db_path):
+    record_order_change(db_path, 45673)
+    key = make_cache_key((45673,), {})
+    assert cache.get("thread", ORDER_TOOL, key) is _MISS
+    cache.put("thread", ORDER_TOOL, key, "cached")
+    assert cache.get("thread", ORDER_TOOL, key) == "cached"
+
+
+def test_entries_expire_after_their_ttl(cache):
+    key = make_cache_key(("return policy",), {})
+    cache.put("thread", POLICY_TOOL, key, ["policy"])
+    assert cache.get("thread", POLICY_TOOL, key) == ["policy"]
+    time.sleep(0.06)
+    assert cache.get("thread", POLICY_TOOL, key) is _MISS
+
+
+def test_daily_tools_expire_at_midnight(cache, monkeypatch):
+    monkeypatch.setattr(tool_cache, "seconds_until_midnight", lambda: 0.05)
+    cache.put("thread", "Get-Todays-Date", "[]", "2025-01-01")
+    assert cache.get("thread", "Get-Todays-Date", "[]") == "2025-01-01"
+    time.sleep(0.06)
+    assert cache.get("thread", "Get-Todays-Date", "[]") is _MISS
+
+
+def test_entries_are_scoped_to_their_thread(cache):
+    key = make_cache_key(("return policy",), {})
+    cache.put("first", POLICY_TOOL, key, ["policy"])
+    assert cache.get("second", POLICY_TOOL, key) is _MISS
+    cache.clear_thread("first")
+    assert cache.get("first", POLICY_TOOL, key) is _MISS
+
+
+def test_least_recently_used_threads_are_evicted(cache):
+    for thread_id in ("a", "b", "c"):
+        cache.put(thread_id, ORDER_TOOL, "[[], {}]", thread_id)
+    assert cache.get("a", ORDER_TOOL, "[[], {}]") is _MISS
+    assert cache.get("c", ORDER_TOOL, "[[], {}]") == "c"
@@ -0,0 +1,118 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from utils import vector_index
+from utils.vector_index import LocalVectorIndex
+
+DIMS = 16
+
+
+def make_vectors(count, seed=0, intents=None):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "id": f"id{i}",
+            "values": rng.normal(size=DIMS).tolist(),
+            "metadata": {"intents": intents(i) if intents else []},
+        }
+        for i in range(count)
+    ]
+
+
+def upsert_in_process(index_dir, vectors):
+    LocalVectorIndex(index_dir, DIMS).upsert(vectors)
+
+
+def delete_in_process(index_dir, ids):
+    LocalVectorIndex(index_dir, DIMS).delete(ids)
+
+
+def run_in_process(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+
+@pytest.fixture(autouse=True)
+def no_refresh_interval(monkeypatch):
+    monkeypatch.setattr(vector_index, "LOCAL_INDEX_REFRESH_INTERVAL", 0.0)
+
+
+def test_reader_sees_rows_and_tombstones_of_another_process(tmp_path):
+    index_dir = str(tmp_path / "index")
+    LocalVectorIndex(index_dir, DIMS)
+    reader = LocalVectorIndex(index_dir, DIMS, readonly=True)
+    vectors = make_vectors(10)
+    assert reader.query(vectors[3]["values"], top_k=1)["matches"] == []
+
+    run_in_process(upsert_in_process, index_dir, vectors)
+    assert reader.query(vectors[3]["values"], top_k=1)["matches"][0]["id"] == "id3"
+
+    run_in_process(delete_in_process, index_dir, ["id3"])
+    ids = [match["id"] for match in reader.query(vectors[3]["values"], top_k=10)["matches"]]
+    assert "id3" not in ids
+    assert len(ids) == 9
+
+
+def test_exact_search_finds_every_vector(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), DIMS)
+    vectors = make_vectors(50)
+    index.upsert(vectors)
+    results = index.query_batch([vector["values"] for vector in vectors], top_k=1)
+    assert [matches[0]["id"] for matches in results] == [vector["id"] for vector in vectors]
+
+
+def test_ivf_recall_against_exact_search(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), DIMS, nprobe=4)
+    index.upsert(make_vectors(2000))
+    index.train(16)
+    queries = np.random.default_rng(1).normal(size=(50, DIMS)).tolist()
+    exact = index.search_exact(queries, top_k=10)
+    approximate = index.query_batch(queries, top_k=10)
+    hits = sum(
+        len({m["id"] for m in a} & {m["id"] for m in e}) for a, e in zip(approximate, exact)
+    )
+    assert hits / (10 * len(queries)) >= 0.7
+
+
+def test_intents_filter(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), DIMS)
+    index.upsert(make_vectors(20, intents=lambda i: ["return"] if i % 2 == 0 else ["shipping"]))
+    matches = index.query([1.0] * DIMS, top_k=20, filter={"intents": {"$in": ["return"]}})["matches"]
+    assert len(matches) == 10
+    assert all(int(match["id"][2:]) % 2 == 0 for match in matches)
+
+
+@pytest.mark.parametrize("train", [False, True])
+def test_intents_filter_with_shared_bits(tmp_path, train):
+    # Intent codes of 64 and above share their bitmask bit with lower codes
+    index = LocalVectorIndex(str(tmp_path), DIMS)
+    index.upsert(make_vectors(70, intents=lambda i: [f"i{i}"]))
+    if train:
+        index.train(4)
+    for intents, expected in ((["i65"], {"id65"}), (["i1"], {"id1"}), (["i3", "i66"], {"id3", "id66"})):
+        matches = index.query([1.0] * DIMS, top_k=5, filter={"intents": {"$in": intents}})["matches"]
+        assert {match["id"] for match in matches} == expected
+
+
+def test_retraining_switches_lists_and_centroids_together(tmp_path):
+    index_dir = str(tmp_path)
+    writer = LocalVectorIndex(index_dir, DIMS)
+    vectors = make_vectors(500)
+    writer.upsert(vectors)
+    writer.train(8)
+    reader = LocalVectorIndex(index_dir, DIMS, readonly=True)
+    assert reader.meta["nlist"] == 8
+
+    # Training writes new files only, the reader keeps using the generation it loaded
+    writer.train(16)
+    assert reader.centroids.shape[0] == reader.meta["nlist"] == 8
+    assert reader.query(vectors[7]["values"], top_k=1)["matches"][0]["id"] == "id7"
+    assert reader.centroids.shape[0] == reader.meta["nlist"] == 16
+    assert int(np.asarray(reader._lists[:reader.count]).max()) < 16
+
+    writer.train(4)
+    assert sorted(p.name for p in tmp_path.glob("centroids*")) == ["centroids.2.npy", "centroids.3.npy"]
@@ -4,22 +4,30 @@ from utils.configs import (
     SUPPORTED_INTENTS,
     DB_PATH,
     ORDERS_TABLE_NAME,
+    ORDER_ELIGIBILITY_VIEW_NAME,
     PINECONE_INDEX_NAME,
     EMBEDDING_MODEL_NAME,
     EMBEDDING_DIMS,
-    TOP_K, RERANK_TOP_N, SCORE_THRESHOLD,
+    TOP_K, FILTERED_TOP_K, RERANK_TOP_N, SCORE_THRESHOLD,
+    RERANK_MODEL_NAME, RERANK_MAX_DOCUMENTS,
+    RETRIEVAL_CONCURRENCY,
     ENV_FILE_PATH
 )
-from utils.policy_ingestion import (
-    create_or_load_pinecone_index
+from utils.vector_store import (
+    create_or_load_vector_index
 )
-from utils.common import load_embedding_model
-from typing import List
+from utils.embedding_service import get_embedding_service
+from utils.intent_classifier import get_intent_classifier
+from utils.order_eligibility import eligibility_view_exists
+from utils.sentence_store import init_sentence_store, get_sentence_texts, save_sentences, encode_intents
+from utils.resilience import get_dependency
+from utils import metrics
+from typing import Dict, List, Optional, Tuple
 
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
 import sqlite3
 from langchain_core.tools import ToolException
 from pinecone import Pinecone
@@ -28,11 +36,20 @@ from dotenv import load_dotenv
 
 load_dotenv(ENV_FILE_PATH)
 pc = Pinecone(os.getenv("PINECONE_API_KEY"))
-pc_index = create_or_load_pinecone_index(
+pc_index = create_or_load_vector_index(
     index_name=PINECONE_INDEX_NAME,
-    embedding_dims=EMBEDDING_DIMS
+    embedding_dims=EMBEDDING_DIMS,
+    readonly=True
+)
+embedding_service = get_embedding_service(EMBEDDING_MODEL_NAME)
+init_sentence_store()
+if not eligibility_view_exists():
+    print(f"Warning: the {ORDER_ELIGIBILITY_VIEW_NAME} view is missing, the order details tool fails "
+          f"until order_data_service.py updates the orders database")
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_CONCURRENCY,
+    thread_name_prefix="retrieval"
 )
-embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME)
 
 def get_intents_from_query(query_text: str) -> List[str]:
     """Retrieves a list of intents from the SUPPORTED INTENTS from the given text."""
@@ -42,6 +59,19 @@ def get_intents_from_query(query_text: str) -> List[str]:
             intents.append(intent)
     return intents
 
+def classify_query_intents(query_texts: List[str], query_vectors: List[List[float]]) -> List[List[str]]:
+    """Retrieves the intents of a batch of queries. The intents named in the text are
+    combined with those the intent classifier predicts from the query embeddings, when
+    a classifier has been trained."""
+    query_intents = [get_intents_from_query(query) for query in query_texts]
+    classifier = get_intent_classifier()
+    if classifier is None:
+        return query_intents
+    return [
+        sorted(set(intents) | set(predicted))
+        for intents, predicted in zip(query_intents, classifier.predict(query_vectors))
+    ]
+
 def get_similar_products_for_order(order_id: int) -> List[str]:
     """
     Retrieves a list of similar products by given order ID. Use this tool only if the user
@@ -118,13 +148,14 @@ def generate_return_authorization(order_id: int) -> str:
 
 def get_order_details(order_id: int) -> dict:
     """
-    Fetches order details from the database given the order ID.
+    Fetches order details from the database given the order ID, along with its return,
+    exchange and damage report eligibility as per the policy windows.
 
     Args:
         order_id: The 5-digit order ID of the order to retrieve.
 
     Returns:
-        A dictionary containing the order details as key values.
+        A dictionary containing the order details and eligibility facts as key values.
 
     Raises:
         ToolException: If no order is found with the given order_id or order_id is invalid.
@@ -137,8 +168,10 @@ def get_order_details(order_id: int) -> dict:
             cursor.execute(f"""
                 SELECT
                     order_id, product_category, product_name, size, quantity, `price_(usd)`,
-                    order_date, status, payment_method, shipping_address, final_sale
-                FROM {ORDERS_TABLE_NAME}
+                    order_date, status, payment_method, shipping_address, is_final_sale,
+                    days_since_order, return_eligible, exchange_eligible, damage_report_eligible,
+                    days_left_to_return, return_ineligibility_reason
+                FROM {ORDER_ELIGIBILITY_VIEW_NAME}
                 WHERE order_id = ?
             """, (order_id,))
 
@@ -154,20 +187,218 @@ def get_order_details(order_id: int) -> dict:
                 "size": result[3],
                 "quantity": result[4],
                 "price_(usd)": result[5],
-                "order_date": datetime.strptime(result[6], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d'),  # Format date
+                "order_date": result[6],
                 "status": result[7],
                 "payment_method": result[8],
                 "shipping_address": result[9],
-                "final_sale": result[10]
+                "final_sale": bool(result[10]),
+                "days_since_order": result[11],
+                "return_eligible": bool(result[12]),
+                "exchange_eligible": bool(result[13]),
+                "damage_report_eligible": bool(result[14]),
+                "days_left_to_return": result[15],
             }
-            
+            if result[16] is not None:
+                order_details["return_ineligibility_reason"] = result[16]
+
             return order_details
 
     except sqlite3.Error as ex:
+        if not eligibility_view_exists():
+            raise ToolException(
+                f"Order details are unavailable: the {ORDER_ELIGIBILITY_VIEW_NAME} view is missing, "
+                f"run order_data_service.py to update the orders database."
+            )
         raise ToolException(f"Database error: {ex}")
     except Exception as ex:
         raise ToolException(str(ex))
 
+def build_intents_filter(query_intents: List[str]) -> Optional[Dict]:
+    """Builds the vector index metadata filter for the given intents, if any. Vectors
+    keep intent codes; the names match the vectors upserted before the codes existed."""
+    return {
+        "intents": {
+            "$in": query_intents + encode_intents(query_intents)
+        }
+    } if len(query_intents) > 0 else None
+
+def get_top_k(query_intents: List[str]) -> int:
+    """Returns the number of candidates to search for, fewer for intents filtered queries."""
+    return FILTERED_TOP_K if len(query_intents) > 0 else TOP_K
+
+def search_policy_index(query_vector: List[float], query_intents: List[str]) -> List[Dict]:
+    """Searches the vector index for one query vector, filtered by intents if any."""
+    query_response = get_dependency("pinecone_query").call(
+        pc_index.query,
+        vector=query_vector,
+        top_k=get_top_k(query_intents),
+        include_metadata=False,
+        include_values=False,
+        filter=build_intents_filter(query_intents)
+    )
+    return query_response["matches"]
+
+def search_policy_index_batch(query_vectors: List[List[float]],
+                              query_intents: List[List[str]]) -> Tuple[List[List[Dict]], List[Optional[str]]]:
+    """Searches the vector index for a batch of query vectors. The local index searches
+    the whole batch in one vectorized call, Pinecone takes one query per request so
+    those run concurrently. Returns the matches and the error (if any) of every query,
+    a failed query gets no matches instead of failing the whole batch."""
+    if hasattr(pc_index, "query_batch"):
+        try:
+            matches_per_query = pc_index.query_batch(
+                query_vectors,
+                top_k=max(get_top_k(intents) for intents in query_intents),
+                filters=[build_intents_filter(intents) for intents in query_intents]
+            )
+        except Exception as ex:
+            return [[] for _ in query_vectors], [str(ex)] * len(query_vectors)
+        return [
+            matches[:get_top_k(intents)] for matches, intents in zip(matches_per_query, query_intents)
+        ], [None] * len(query_vectors)
+
+    def search(query_vector, intents):
+        try:
+            return search_policy_index(query_vector, intents), None
+        except Exception as ex:
+            return [], str(ex)
+
+    results = list(retrieval_executor.map(search, query_vectors, query_intents))
+    return [matches for matches, _ in results], [error for _, error in results]
+
+def hydrate_policy_texts(candidate_ids: List[str]) -> Dict[str, str]:
+    """Returns the texts of the candidate vectors from the local sentence store. Texts
+    missing there (vectors upserted before the store existed) are read once from the
+    vector metadata and saved to the store. Candidates without a text are dropped."""
+    texts = get_sentence_texts(candidate_ids)
+    missing = [candidate_id for candidate_id in candidate_ids if candidate_id not in texts]
+    if len(missing) == 0:
+        return texts
+    metrics.increment("retrieval.sentence_store_misses", len(missing))
+
+    recovered = {}
+    try:
+        # Chunked, as the fetch request carries the IDs in its URL
+        for start in range(0, len(missing), 100):
+            response = get_dependency("pinecone_query").call(pc_index.fetch, ids=missing[start:start + 100])
+            for vector_id, vector in response.vectors.items():
+                text = (vector["metadata"] or {}).get("text")
+                if text:
+                    recovered[vector_id] = text
+    except Exception as ex:
+        print(f"Could not read the texts of {len(missing)} candidate(s) from the vector metadata: {ex}")
+    if recovered:
+        save_sentences([{"id": vector_id, "text": text} for vector_id, text in recovered.items()])
+        texts.update(recovered)
+
+    dropped = len(missing) - len(recovered)
+    if dropped > 0:
+        metrics.increment("retrieval.dropped_candidates", dropped)
+        print(f"Dropped {dropped} candidate(s) whose text is neither in the sentence store "
+              f"nor in the vector metadata")
+    return texts
+
+def rerank_policies(query_text: str, policies: List[Dict]) -> List[str]:
+    """Reranks the candidate policies for the query and returns the top texts. Falls
+    back to the given (vector search) order if the rerank service is unavailable."""
+    if len(policies) == 0:
+        return []
+
+    def rerank():
+        reranked_policies = pc.inference.rerank(
+            model=RERANK_MODEL_NAME,
+            query=query_text,
+            documents=policies,
+            top_n=RERANK_TOP_N,
+            return_documents=True,
+        )
+        # Filter out low-scoring policies
+        return [
+            doc.document.text for doc in reranked_policies.rerank_result.data \
+                if doc["score"] >= SCORE_THRESHOLD
+        ]
+
+    return get_dependency("pinecone_rerank").call(
+        rerank,
+        fallback=lambda: [policy["text"] for policy in policies[:RERANK_TOP_N]]
+    )
+
+def retrieve_relevant_policies_by_queries(query_texts: List[str], merge: bool = False
+                                          ) -> Tuple[List[List[str]], List[Optional[str]]]:
+    """Retrieves the most relevant policies for a batch of user queries.
+
+    Queries are deduplicated and encoded in one batch, the index searches run
+    concurrently and candidates shared between queries are collected only once.
+    The rerank API takes one query per request, so reranking runs as a single
+    concurrent pass over the batch. With merge=True
+    the queries are treated as parts of one request (ex - several intents of the same
+    user turn): the deduplicated candidates of all queries are reranked once against
+    the combined query, and every query gets that same result.
+
+    A query whose index search fails gets no policies while the rest of the batch goes
+    on, only when every query fails is the error raised.
+
+    Args:
+        query_texts: The user query strings.
+        merge: Whether to rerank the union of candidates once for all queries.
+
+    Returns:
+        A list with the relevant policies for each query, in the input order, and a
+        list with the error of each query (None if it succeeded).
+    """
+    unique_queries = list(dict.fromkeys(query_texts))
+    if len(unique_queries) == 0:
+        return [], []
+
+    # Batched together with the queries of the concurrent conversations
+    query_vectors = embedding_service.encode(unique_queries).tolist()
+    query_intents = classify_query_intents(unique_queries, query_vectors)
+    matches_per_query, search_errors = search_policy_index_batch(query_vectors, query_intents)
+    if all(error is not None for error in search_errors):
+        raise RuntimeError(f"Policy index search failed: {search_errors[0]}")
+    errors_by_query = dict(zip(unique_queries, search_errors))
+    for query, error in errors_by_query.items():
+        if error is not None:
+            metrics.increment("retrieval.search_errors")
+            print(f"Policy index search failed for query {query!r}: {error}")
+    errors = [errors_by_query[query] for query in query_texts]
+
+    # Collect the candidates once, keeping the best vector score for each of them
+    candidates = {}
+    for matches in matches_per_query:
+        for match in matches:
+            if match["id"] not in candidates or match["score"] > candidates[match["id"]]["score"]:
+                candidates[match["id"]] = {"id": match["id"], "score": match["score"]}
+
+    # The index returns IDs only, the texts are hydrated from the local sentence store
+    texts = hydrate_policy_texts(list(candidates))
+    for candidate_id in list(candidates):
+        if candidate_id in texts:
+            candidates[candidate_id]["text"] = texts[candidate_id]
+        else:
+            del candidates[candidate_id]
+
+    if merge:
+        merged_candidates = sorted(candidates.values(), key=lambda x: x["score"], reverse=True)
+        merged_policies = rerank_policies(
+            " ".join(unique_queries),
+            [{"id": x["id"], "text": x["text"]} for x in merged_candidates[:RERANK_MAX_DOCUMENTS]]
+        )
+        return [list(merged_policies) for _ in query_texts], errors
+
+    policies_per_query = [
+        [
+            {"id": match["id"], "text": candidates[match["id"]]["text"]}
+            for match in matches if match["id"] in candidates
+        ]
+        for matches in matches_per_query
+    ]
+    reranked = dict(zip(
+        unique_queries,
+        retrieval_executor.map(rerank_policies, unique_queries, policies_per_query)
+    ))
+    return [list(reranked[query]) for query in query_texts], errors
+
 def retrieve_relevant_policies_by_query(query_text: str) -> List[str]:
     """Retrieves the most relevant policies from the vector store for the given user query.
     The policies are ranked as per their relevance with the given user query.
@@ -182,43 +413,9 @@ def retrieve_relevant_policies_by_query(query_text: str) -> List[str]:
         ToolException: If any error occurs during the process.
     """
     try:
-        # Search Pinecone index
-        query_intents = get_intents_from_query(query_text)
-        query_response = pc_index.query(
-            vector=embedding_model.encode(query_text).tolist(),
-            top_k=TOP_K,
-            include_metadata=True,
-            include_values=False,
-            filter={
-                "intents": {
-                    "$in": query_intents
-                }
-            } if len(query_intents) > 0 else None
-        )
-
-        # Prepare policies for reranking
-        policies = [
-            {"id": x["id"], "text": x["metadata"]["text"]}
-            for x in query_response["matches"]
-        ]
-
-        # Rerank policies
-        reranked_policies = pc.inference.rerank(
-            model="bge-reranker-v2-m3",
-            query=query_text,
-            documents=policies,
-            top_n=RERANK_TOP_N,
-            return_documents=True,
-        )
-
-        # Filter out low-scoring policies
-        filtered_policies = [
-            doc.document.text for doc in reranked_policies.rerank_result.data \
-                if doc["score"] >= SCORE_THRESHOLD
-        ]
-        
-        return filtered_policies
-
+        # A single query either succeeds or raises, it has no error to report
+        policies, _ = retrieve_relevant_policies_by_queries([query_text])
+        return policies[0]
     except Exception as ex:
         raise ToolException(str(ex))
 
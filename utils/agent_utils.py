@@ -1,14 +1,17 @@
 """This module contains all the functions which the chat agent uses for running"""
 
 import os
+import time
+from functools import lru_cache
 from textwrap import dedent
-from typing import Annotated
+from typing import Annotated, Dict, List, Tuple
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages, AnyMessage
 from langchain_groq import ChatGroq
-from langchain_core.messages import ToolMessage
+from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
 from langchain_core.tools import StructuredTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.prompts import ChatPromptTemplate
@@ -18,7 +21,11 @@ from utils.configs import (
     CHATBOT_MODEL_NAME,
     CHATBOT_TEMPERATURE,
     CHATBOT_MAX_TOKENS,
+    MAX_REPROMPT_ITERATIONS,
 )
+from utils import metrics
+from utils.resilience import get_dependency
+from utils.tool_cache import cache_tool_results
 from utils.agent_tools import (
     get_intents_from_query,
     get_similar_products_for_order,
@@ -75,9 +82,19 @@ class Assistant:
         self.runnable = runnable
 
     def __call__(self, state: State, config: RunnableConfig):
-        while True:
-            configuration = config.get("configurable", {})
-            result = self.runnable.invoke(state)
+        for _ in range(MAX_REPROMPT_ITERATIONS):
+            result = get_dependency("groq_chat").call(
+                self.runnable.invoke,
+                state,
+                # Passed on explicitly, the call runs in a pool thread which does not
+                # inherit the context (callbacks, tracing, streaming) of the graph node
+                config,
+                fallback=lambda: AIMessage(content=(
+                    "Sorry, I am having trouble reaching my services right now. "
+                    "Please try again in a moment."
+                ))
+            )
+            record_prompt_usage(result)
             # If the LLM happens to return an empty response, we will re-prompt it
             # for an actual response.
             if not result.tool_calls and (
@@ -89,40 +106,111 @@ class Assistant:
                 state = {**state, "messages": messages}
             else:
                 break
+        else:
+            # Stop re-prompting after MAX_REPROMPT_ITERATIONS empty responses
+            result = AIMessage(content="Sorry, I could not come up with an answer. Could you rephrase your question?")
         return {"messages": result}
 
 
+PRIMARY_ASSISTANT_SYSTEM_PROMPT = dedent("""\
+    You are a specialised customer support assistant chatbot for a footwear business. You MUST only answer questions related to business.
+
+    ## DECISION MAKING RULES
+
+    Follow the below rules very strictly for doing your job:
+        1. You MUST ALWAYS answer query using only the information provided by your tools.
+        2. If the user is asking for some process related information, use the tool and user query to fetch the policy information, and return the result. Ex - what is the return policy?
+        3. If the user is asking to perform any action given any specific order Id, use the tools to fetch both order details and policy details. Ex - i want to return my order 45673
+        4. In case of any exchange, return or refund be very careful about policy rules and make sure they are not violated. Ex - sale items, days passed since order, etc.
+        5. While checking eligibility for return/exchange etc. be careful about all the policy rules applicable. The order details already give the days passed since order date and the return, exchange and damage report eligibility with its reason, use them as they are.
+        6. In case user is asking for product recommendation just use the order Id and the required tool.
+        7. If the user is sure to return the product, first check eligibility, then call the tool to generate request authorization number and send it back to the user.
+        8. Do not create or assume any information. Use the information provided by the tools ONLY. If you cannot answer say you cannot.
+        9. The final answer should be very crisp and to the point in max 2-3 sentences. It also should be conversational and human-like.
+        10. Don't refer the user to chatbot. You are the chatbot and should do the job.
+    
+    ## END OF RULES
+    """)
+
 def load_primary_assistant_prompt():
     """Load the primary assistant prompt"""
     primary_assistant_prompt = ChatPromptTemplate.from_messages(
         [
-            (
-                "system",
-                dedent("""\
-                You are a specialised customer support assistant chatbot for a footwear business. You MUST only answer questions related to business.
-
-                ## DECISION MAKING RULES
-
-                Follow the below rules very strictly for doing your job:
-                    1. You MUST ALWAYS answer query using only the information provided by your tools.
-                    2. If the user is asking for some process related information, use the tool and user query to fetch the policy information, and return the result. Ex - what is the return policy?
-                    3. If the user is asking to perform any action given any specific order Id, use the tools to fetch both order details and policy details. Ex - i want to return my order 45673
-                    4. In case of any exchange, return or refund be very careful about policy rules and make sure they are not violated. Ex - sale items, days passed since order, etc.
-                    5. While checking eligibility for return/exchange etc. be careful about all the policy rules applicable. Always use tool to calculate days passed since order date.
-                    6. In case user is asking for product recommendation just use the order Id and the required tool.
-                    7. If the user is sure to return the product, first check eligibility, then call the tool to generate request authorization number and send it back to the user.
-                    8. Do not create or assume any information. Use the information provided by the tools ONLY. If you cannot answer say you cannot.
-                    9. The final answer should be very crisp and to the point in max 2-3 sentences. It also should be conversational and human-like.
-                    10. Don't refer the user to chatbot. You are the chatbot and should do the job.
-                
-                ## END OF RULES
-                """)
-            ),
+            ("system", PRIMARY_ASSISTANT_SYSTEM_PROMPT),
             ("placeholder", "{messages}"),
         ]
     )
     return primary_assistant_prompt
 
+@lru_cache(maxsize=1)
+def load_primary_assistant_system_message() -> SystemMessage:
+    """Load the primary assistant system message. It is built once and shared by every
+    call, which also keeps the prompt prefix byte-identical for provider prompt caching."""
+    return SystemMessage(content=PRIMARY_ASSISTANT_SYSTEM_PROMPT)
+
+class FrozenDict(dict):
+    """Read-only dict, still serializable as a JSON object."""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is read-only")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def freeze(value):
+    """Returns a read-only copy of a JSON-like value."""
+    if isinstance(value, dict):
+        return FrozenDict({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def compile_tool_schemas(tools: List[StructuredTool]) -> Tuple[Dict, ...]:
+    """Converts the tools (with their docstring parsed argument descriptions) to the
+    provider's JSON tool schemas once, as read-only objects reused for every call."""
+    return tuple(freeze(convert_to_openai_tool(tool)) for tool in tools)
+
+def measure_uncached_prompt_seconds(tools: List[StructuredTool], runs: int = 5) -> float:
+    """Measures the time of rendering the prompt template and converting the tool
+    schemas, the per call work saved by the precompiled prompt."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        load_primary_assistant_prompt().invoke({"messages": []})
+        [convert_to_openai_tool(tool) for tool in tools]
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+def create_precompiled_prompt(uncached_prompt_seconds: float) -> Runnable:
+    """Creates the runnable which puts the precompiled system message in front of the
+    conversation messages, in place of rendering the prompt template."""
+    system_message = load_primary_assistant_system_message()
+
+    def build_messages(state: State) -> list:
+        start = time.perf_counter()
+        messages = [system_message, *state["messages"]]
+        elapsed = time.perf_counter() - start
+        metrics.observe("assistant.prompt_build", elapsed)
+        metrics.increment("assistant.prompt_build.saved_seconds", max(0.0, uncached_prompt_seconds - elapsed))
+        return messages
+
+    return RunnableLambda(build_messages)
+
+def record_prompt_usage(result: AIMessage) -> None:
+    """Records the prompt tokens of an LLM call, and the part served from the provider's
+    prompt cache when it reports one."""
+    usage = getattr(result, "usage_metadata", None) or {}
+    metrics.increment("assistant.prompt_tokens", usage.get("input_tokens", 0))
+    token_usage = getattr(result, "response_metadata", {}).get("token_usage", {}) or {}
+    prompt_details = token_usage.get("prompt_tokens_details") or {}
+    metrics.increment("assistant.cached_prompt_tokens", prompt_details.get("cached_tokens", 0) or 0)
+
 def create_and_return_agent_toolbox():
     """Create and agent toolbox"""
     product_recommendor_tool = StructuredTool.from_function(
@@ -165,11 +253,14 @@ def create_and_return_agent_toolbox():
         handle_tool_error=True
     )
 
+    # Safe tool results are cached per conversation thread
     primary_assistant_safe_tools = [
-        get_order_details_tool,
-        get_relevant_policies_by_query_tool,
-        days_since_date_tool,
-        product_recommendor_tool,
+        cache_tool_results(tool) for tool in [
+            get_order_details_tool,
+            get_relevant_policies_by_query_tool,
+            days_since_date_tool,
+            product_recommendor_tool,
+        ]
     ]
 
     primary_assistant_sensitive_tools = [
@@ -190,6 +281,8 @@ def create_primary_assistant_runnable_and_build_graph():
         model=CHATBOT_MODEL_NAME,
         temperature=CHATBOT_TEMPERATURE,
         max_tokens=CHATBOT_MAX_TOKENS,
+        # Retries and timeouts are handled by the resilience layer
+        max_retries=0,
         api_key=os.getenv('GROQ_API_KEY')
     )
 
@@ -207,12 +300,16 @@ def create_primary_assistant_runnable_and_build_graph():
             return "sensitive_tools"
         return "safe_tools"
     
-    primary_assistant_prompt = load_primary_assistant_prompt()
     primary_assistant_tools, primary_assistant_safe_tools, \
         primary_assistant_sensitive_tools = create_and_return_agent_toolbox()
 
-    primary_assistant_runnable = primary_assistant_prompt | llm.bind_tools(
-        primary_assistant_tools
+    # The system prompt and tool schemas are static, so they are compiled once here
+    # instead of being rendered and serialized again on every assistant call
+    primary_assistant_prompt = create_precompiled_prompt(
+        measure_uncached_prompt_seconds(primary_assistant_tools)
+    )
+    primary_assistant_runnable = primary_assistant_prompt | llm.bind(
+        tools=list(compile_tool_schemas(primary_assistant_tools))
     )
 
     builder = StateGraph(State)
@@ -239,3 +336,31 @@ def create_primary_assistant_runnable_and_build_graph():
     )
 
     return graph
+
+
+CONFIRMATION_QUESTION = "Should I generate the RA number for you? yes/no"
+
+def run_chat_turn(graph, config: RunnableConfig, message: str) -> Tuple[str, bool]:
+    """Runs one user turn of the conversation thread given in the config. The pending
+    sensitive tool call of the thread, if any, is read from the graph state, so turns
+    of different threads can run concurrently.
+
+    Returns the bot response, and whether the bot awaits the user's confirmation."""
+    snapshot = graph.get_state(config)
+    if snapshot.next:
+        if message.lower().startswith("yes"):
+            result = graph.invoke(None, config)
+        else:
+            result = graph.invoke({
+                "messages": [
+                    ToolMessage(
+                        tool_call_id=snapshot.values['messages'][-1].tool_calls[0]['id'],
+                        content=f"Generate-Return-Authorization denied by user. Reasoning: '{message}'. Proceed with last conversation.",
+                    )]
+            }, config)
+    else:
+        result = graph.invoke({"messages": [("user", message)]}, config)
+
+    if graph.get_state(config).next:
+        return CONFIRMATION_QUESTION, True
+    return result['messages'][-1].content, False
@@ -1,12 +1,57 @@
 """This module contains common utility functions used across the application."""
 
 import os
-from sentence_transformers import SentenceTransformer
-
-def load_embedding_model(model_name: str) -> SentenceTransformer:
-  """Loads the embedding model."""
-  model = SentenceTransformer(
-      model_name,
-      token=os.getenv('HF_API_KEY', None)
-  )
-  return model
\ No newline at end of file
+import json
+from typing import IO, TYPE_CHECKING, Dict, Iterator
+
+if TYPE_CHECKING:
+  from sentence_transformers import SentenceTransformer
+
+_embedding_models: Dict[str, "SentenceTransformer"] = {}
+
+def load_embedding_model(model_name: str) -> "SentenceTransformer":
+  """Loads the embedding model. It is loaded once per process and shared by all its
+  callers, and by the forked serving workers (see serve.py). sentence-transformers
+  (and torch) are imported here, so the JSONL helpers of this module stay light."""
+  from sentence_transformers import SentenceTransformer
+
+  if model_name not in _embedding_models:
+      _embedding_models[model_name] = SentenceTransformer(
+          model_name,
+          token=os.getenv('HF_API_KEY', None)
+      )
+  return _embedding_models[model_name]
+
+def get_jsonl_file_path(filename: str, json_output_dir: str) -> str:
+  """Returns the path of the JSONL file holding the parsed records of a policy document."""
+  return os.path.join(json_output_dir, os.path.splitext(filename)[0] + '.jsonl')
+
+def repair_jsonl_tail(jsonl_file_path: str) -> None:
+  """Truncates a partially written last line, left behind if the writer crashed."""
+  if not os.path.exists(jsonl_file_path):
+      return
+  with open(jsonl_file_path, 'rb+') as f:
+      data = f.read()
+      if data and not data.endswith(b'\n'):
+          f.truncate(data.rfind(b'\n') + 1)
+
+def append_jsonl_record(f: IO, record: Dict) -> None:
+  """Appends one record to an open JSONL file and makes sure it reaches the disk."""
+  f.write(json.dumps(record) + '\n')
+  f.flush()
+  os.fsync(f.fileno())
+
+def iter_jsonl_records(jsonl_file_path: str, start_line: int = 0) -> Iterator[Dict]:
+  """Yields the records of a JSONL file from the given line number onwards. Each record
+  gets its line number as 'line_no'. A partially written last line is skipped."""
+  with open(jsonl_file_path, 'r') as f:
+      for line_no, line in enumerate(f):
+          if line_no < start_line:
+              continue
+          try:
+              record = json.loads(line)
+          except json.JSONDecodeError:
+              print(f"Skipping invalid line {line_no} in {jsonl_file_path}")
+              continue
+          record['line_no'] = line_no
+          yield record
@@ -1,5 +1,5 @@
 """This module contains all the configurations and constants used in the application."""
-from typing import Set
+from typing import Dict, List, Set
 
 # FILE LOCATIONS
 ORDERS_EXCEL_PATH: str = "./data/orders_table.xlsx"
@@ -7,33 +7,123 @@ DB_PATH: str = "./data/chatbot.db"
 ENV_FILE_PATH: str = "./data/.env"
 POLICY_DOCS_DIR: str = "./data/policy_docs"
 POLICY_DOCS_JSON_DIR: str = "./data/policy_docs"
+INTENT_CLASSIFIER_PATH: str = "./data/intent_classifier.npz"
 
 # DATABASE CONFIGURATIONS
 ORDERS_TABLE_NAME: str = "orders"
 UNIQUE_ID_COLUMN: str = "order_id"
 POLICY_TABLE_NAME: str = "policy_processed"
+INGESTION_JOBS_TABLE_NAME: str = "ingestion_jobs"
+INGESTION_TASKS_TABLE_NAME: str = "ingestion_tasks"
+ORDER_CHANGES_TABLE_NAME: str = "order_changes"
+ORDER_ELIGIBILITY_VIEW_NAME: str = "order_eligibility"
+SENTENCES_TABLE_NAME: str = "policy_sentences"
+INTENT_CODES_TABLE_NAME: str = "intent_codes"
+SENTENCE_TEXT_CACHE_SIZE: int = 50000   # policy texts kept in memory by the chatbot
 SLEEP_TIME: int = 3600   # 1 hour in seconds
 
+# INGESTION JOB CONFIGURATIONS
+INGESTION_WORKERS: int = 1
+INGESTION_LEASE_SECONDS: int = 600   # renewed after every subsection and batch
+INGESTION_MAX_JOB_ATTEMPTS: int = 5
+INGESTION_MAX_TASK_ATTEMPTS: int = 3
+INGESTION_DRAIN_CHECK_INTERVAL: int = 60   # seconds between the checks for drained jobs, to retrain the intent classifier
+
+# ORDER POLICY CONFIGURATIONS
+# Windows (in days since the order date) of the return eligibility view
+RETURN_WINDOW_DAYS: int = 30
+EXCHANGE_WINDOW_DAYS: int = 30
+DAMAGE_REPORT_WINDOW_DAYS: int = 7
+ORDER_STATUSES: Set = {"delivered", "shipped", "processing"}   # others are stored as "unknown"
+
 # MODEL CONFIGURATIONS
 POLICY_PARSING_MODEL_NAME: str = "gemma2-9b-it"
+PARSING_CHUNK_TARGET_TOKENS: int = 1000   # input size the small subsections are packed up to
+PARSING_CHUNK_MAX_TOKENS: int = 1500   # larger subsections are split on sentence boundaries
+PARSING_CHUNK_OVERLAP_SENTENCES: int = 1
+PARSING_CHARS_PER_TOKEN: int = 4   # token estimate when tiktoken is unavailable
 EMBEDDING_MODEL_NAME: str = "sentence-transformers/all-mpnet-base-v2"
 EMBEDDING_DIMS: int = 768
+EMBEDDING_BATCH_SIZE: int = 64
+EMBEDDING_MAX_BATCH_SIZE: int = 64   # texts per batch of the micro-batching embedding service
+EMBEDDING_MAX_WAIT_MS: float = 5.0   # time a request waits for others to join its batch
+RERANK_MODEL_NAME: str = "bge-reranker-v2-m3"
 
 # PINECONE CONFIGURATIONS
 PINECONE_INDEX_NAME: str = "policy-info-index"
+UPSERT_BATCH_SIZE: int = 100
+
+# VECTOR STORE CONFIGURATIONS
+VECTOR_STORE_BACKEND: str = "pinecone"   # "pinecone" or "local" (self-hosted IVF index)
+LOCAL_INDEX_DIR: str = "./data/policy_index"
+LOCAL_INDEX_NPROBE: int = 8   # lists scanned per query
+LOCAL_INDEX_TRAIN_MIN_ROWS: int = 20000   # below this the local index is searched exactly
+LOCAL_INDEX_TRAIN_SAMPLE: int = 100000
+LOCAL_INDEX_REFRESH_INTERVAL: float = 10.0
 
 # CHATBOT CONFIGURATIONS
 SUPPORTED_INTENTS: Set = {
     "return", "refund", "exchange", "damaged item", "shipping", "payment", "replacement"
 }
 TOP_K: int = 50
+FILTERED_TOP_K: int = 20   # candidates of queries narrowed down by an intents filter
 RERANK_TOP_N: int = 5
 SCORE_THRESHOLD: float = 0.0
+RERANK_MAX_DOCUMENTS: int = 100   # rerank model limit on documents per request
+RETRIEVAL_CONCURRENCY: int = 8
+INTENT_CONFIDENCE_THRESHOLD: float = 0.5
+INTENT_THRESHOLDS: Dict[str, float] = {}   # per intent overrides of the confidence threshold
+INTENT_MIN_TRAINING_EXAMPLES: int = 20
+
+# TOOL RESULT CACHE CONFIGURATIONS
+# TTL in seconds per tool name, results of the daily tools are kept till midnight
+TOOL_CACHE_TTLS: Dict[str, float] = {
+    "Get-Order-Details": 300,
+    "Product-Recommendor-By-OrderID": 300,
+    "Get-Relevant-Policies-By-Query": 3600,
+}
+TOOL_CACHE_DAILY_TOOLS: Set = {"Days-Since-Date"}
+# Tools whose cached results are invalidated when the order sync changes the order
+TOOL_CACHE_ORDER_KEYED_TOOLS: Set = {"Get-Order-Details", "Product-Recommendor-By-OrderID"}
+TOOL_CACHE_MAX_THREADS: int = 1000
+TOOL_CACHE_MAX_ENTRIES_PER_THREAD: int = 64
+ORDER_CHANGES_POLL_INTERVAL: float = 10.0
 CHATBOT_MODEL_NAME: str = "llama3-70b-8192"
 CHATBOT_TEMPERATURE: float = 0.3
 CHATBOT_MAX_TOKENS: int = 256
+MAX_REPROMPT_ITERATIONS: int = 3
 
+# SERVING CONFIGURATIONS (serve.py)
+SERVE_HOST: str = "0.0.0.0"
+SERVE_PORT: int = 8000
+SERVE_WORKERS: int = 2
+SERVE_WORKER_BASE_PORT: int = 8100   # workers listen on localhost, from this port onwards
+SERVE_WORKER_THREADS: int = 0   # torch threads per worker, 0 shares the CPU cores between the workers
+# Modules of the ingestion and training code the chat path must not import, checked
+# by serve.py before forking and reported by benchmarks/memory_profile.py
+SLIM_SERVING_EXCLUDED_MODULES: List[str] = [
+    "pandas", "pymupdf4llm", "sklearn",
+    "utils.orders", "utils.policy_parsing", "utils.policy_ingestion", "utils.ingestion_jobs"
+]
 
-
-
-
+# RESILIENCE CONFIGURATIONS
+# Per remote dependency: timeout (seconds per attempt), attempts, jittered backoff
+# (base_delay/max_delay), optional hedge_delay and circuit breaker settings.
+DEPENDENCY_POLICIES: Dict[str, Dict] = {
+    "pinecone_query": {
+        "timeout": 3.0, "attempts": 2, "base_delay": 0.2, "max_delay": 1.0,
+        "hedge_delay": 0.5, "failure_threshold": 5, "reset_timeout": 30.0
+    },
+    "pinecone_rerank": {
+        "timeout": 3.0, "attempts": 1, "failure_threshold": 3, "reset_timeout": 60.0
+    },
+    "groq_chat": {
+        "timeout": 30.0, "attempts": 2, "base_delay": 0.5, "max_delay": 4.0,
+        "failure_threshold": 5, "reset_timeout": 30.0
+    },
+    "groq_policy_parsing": {
+        "timeout": 60.0, "attempts": 3, "base_delay": 1.0, "max_delay": 10.0,
+        "failure_threshold": 5, "reset_timeout": 120.0
+    },
+}
+RESILIENCE_POOL_SIZE: int = 32
@@ -0,0 +1,118 @@
+"""This module contains the micro-batching embedding service.
+
+Concurrent callers each encoding a text or two waste most of the matrix throughput
+of the model on tiny batches. The service queues their requests, waits up to
+EMBEDDING_MAX_WAIT_MS for more to arrive (or until EMBEDDING_MAX_BATCH_SIZE texts are
+queued), encodes them in one batch and hands every caller its rows through a future."""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+import numpy as np
+
+from utils import metrics
+from utils.common import load_embedding_model
+from utils.configs import EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_MAX_WAIT_MS
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+class EmbeddingService:
+    """Batches the encode requests of concurrent callers of one embedding model."""
+
+    def __init__(self, model: "SentenceTransformer", max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+                 max_wait_ms: float = EMBEDDING_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._requests: "queue.Queue[Tuple[List[str], Future, float]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self) -> None:
+        # Started on first use, and again in a forked serving worker, as the thread
+        # of the parent process does not survive the fork
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._requests = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queues the texts for encoding, the future resolves to their embeddings."""
+        future = Future()
+        if len(texts) == 0:
+            future.set_result(np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32))
+            return future
+        self._ensure_started()
+        self._requests.put((list(texts), future, time.perf_counter()))
+        return future
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encodes the texts in a batch shared with the concurrent callers."""
+        return self.submit(texts).result()
+
+    def _collect_batch(self) -> List[Tuple[List[str], Future, float]]:
+        """Blocks for the first request, then gathers more until the batch is full or
+        the wait time of the first request is over."""
+        batch = [self._requests.get()]
+        batch_size = len(batch[0][0])
+        deadline = batch[0][2] + self.max_wait_ms / 1000
+        while batch_size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                # Requests queued while the previous batch was encoded join right away
+                if timeout <= 0:
+                    request = self._requests.get_nowait()
+                else:
+                    request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            batch_size += len(request[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            # Requests already cancelled by their callers are dropped
+            batch = [request for request in batch if request[1].set_running_or_notify_cancel()]
+            if len(batch) == 0:
+                continue
+            texts = [text for request in batch for text in request[0]]
+            start = time.perf_counter()
+            for _, _, queued_at in batch:
+                metrics.observe("embedding_service.queue_wait", start - queued_at)
+            try:
+                embeddings = self.model.encode(texts, batch_size=self.max_batch_size)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            metrics.observe("embedding_service.encode", time.perf_counter() - start)
+            metrics.increment("embedding_service.batches")
+            metrics.increment("embedding_service.texts", len(texts))
+
+            offset = 0
+            for request_texts, future, _ in batch:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name: str) -> EmbeddingService:
+    """Returns the embedding service of the model, shared by all callers of the process."""
+    with _services_lock:
+        if model_name not in _services:
+            _services[model_name] = EmbeddingService(load_embedding_model(model_name))
+        return _services[model_name]
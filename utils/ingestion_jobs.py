@@ -0,0 +1,277 @@
+"""This module contains the crash-safe job state of the policy ingestion service.
+
+Every policy document is a job which goes through the stages
+pending -> parsing -> parsed -> indexing -> indexed (or failed). A worker leases a
+job before working on it, so several worker processes can share the queue, and
+records the progress of every subsection (parsing) and upsert batch (indexing) as
+a task. A restarted or retried job only redoes its unfinished tasks."""
+
+import os
+import time
+import socket
+import sqlite3
+from typing import Iterable, Optional, Tuple
+
+from utils.configs import (
+    POLICY_TABLE_NAME,
+    INGESTION_JOBS_TABLE_NAME,
+    INGESTION_TASKS_TABLE_NAME,
+    INGESTION_LEASE_SECONDS,
+    INGESTION_MAX_JOB_ATTEMPTS,
+    INGESTION_MAX_TASK_ATTEMPTS,
+)
+
+PENDING = "pending"
+PARSING = "parsing"
+PARSED = "parsed"
+INDEXING = "indexing"
+INDEXED = "indexed"
+FAILED = "failed"
+
+TASK_PENDING = "pending"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+
+
+class LeaseLostError(Exception):
+    """Raised when a worker no longer holds the lease of the job it works on."""
+
+
+class IncompleteStageError(Exception):
+    """Raised when a stage finished with tasks left to retry."""
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Opens a connection which waits for the locks of the other workers."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.isolation_level = None
+    return conn
+
+
+def get_worker_id() -> str:
+    """Returns a unique ID of the current worker process."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def init_job_tables(db_path: str) -> None:
+    """Creates the job tables and imports the files of the old policy_processed table."""
+    with connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {INGESTION_JOBS_TABLE_NAME} (
+                filename TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                updated_at REAL
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {INGESTION_TASKS_TABLE_NAME} (
+                filename TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                task_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (filename, kind, task_key)
+            )
+        """)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (POLICY_TABLE_NAME,))
+        if cursor.fetchone():
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO {INGESTION_JOBS_TABLE_NAME} (filename, stage, updated_at)
+                SELECT filename,
+                    CASE status WHEN 'index updated' THEN ? WHEN 'parsing done' THEN ? ELSE ? END,
+                    ?
+                FROM {POLICY_TABLE_NAME}
+            """, (INDEXED, PARSED, PENDING, time.time()))
+
+
+def register_jobs(db_path: str, filenames: Iterable[str]) -> None:
+    """Adds a pending job for every new file."""
+    now = time.time()
+    with connect(db_path) as conn:
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {INGESTION_JOBS_TABLE_NAME} (filename, stage, updated_at) VALUES (?, ?, ?)",
+            [(filename, PENDING, now) for filename in filenames]
+        )
+
+
+def claim_next_job(db_path: str, worker_id: str) -> Optional[Tuple[str, str]]:
+    """Leases the oldest unfinished job which no other worker holds. A job whose
+    lease expired (its worker died) is taken over. Returns (filename, stage)."""
+    now = time.time()
+    conn = connect(db_path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"""
+            SELECT filename, stage FROM {INGESTION_JOBS_TABLE_NAME}
+            WHERE stage NOT IN (?, ?)
+                AND (lease_owner IS NULL OR lease_expires < ?)
+            ORDER BY updated_at
+            LIMIT 1
+        """, (INDEXED, FAILED, now))
+        row = cursor.fetchone()
+        if row is not None:
+            cursor.execute(f"""
+                UPDATE {INGESTION_JOBS_TABLE_NAME}
+                SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?
+                WHERE filename = ?
+            """, (worker_id, now + INGESTION_LEASE_SECONDS, now, row[0]))
+        cursor.execute("COMMIT")
+        return row
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def count_unfinished_jobs(db_path: str) -> int:
+    """Returns the number of jobs which are neither indexed nor failed for good."""
+    with connect(db_path) as conn:
+        cursor = conn.execute(
+            f"SELECT COUNT(*) FROM {INGESTION_JOBS_TABLE_NAME} WHERE stage NOT IN (?, ?)", (INDEXED, FAILED)
+        )
+        return cursor.fetchone()[0]
+
+
+def fail_job(db_path: str, filename: str, worker_id: str, error: str) -> None:
+    """Releases the job after an error. It is retried later, unless it has used up
+    INGESTION_MAX_JOB_ATTEMPTS, in which case it is marked failed."""
+    with connect(db_path) as conn:
+        conn.execute(f"""
+            UPDATE {INGESTION_JOBS_TABLE_NAME}
+            SET stage = CASE WHEN attempts >= ? THEN ? ELSE stage END,
+                lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ?
+            WHERE filename = ? AND lease_owner = ?
+        """, (INGESTION_MAX_JOB_ATTEMPTS, FAILED, error, time.time(), filename, worker_id))
+
+
+class JobProgress:
+    """Progress of one leased job: its stage, lease and tasks."""
+
+    def __init__(self, db_path: str, filename: str, worker_id: str):
+        self.db_path = db_path
+        self.filename = filename
+        self.worker_id = worker_id
+        self._finished = {}
+
+    def renew_lease(self) -> None:
+        """Extends the lease of the job, raises LeaseLostError if another worker took it."""
+        now = time.time()
+        with connect(self.db_path) as conn:
+            cursor = conn.execute(f"""
+                UPDATE {INGESTION_JOBS_TABLE_NAME} SET lease_expires = ?, updated_at = ?
+                WHERE filename = ? AND lease_owner = ?
+            """, (now + INGESTION_LEASE_SECONDS, now, self.filename, self.worker_id))
+            if cursor.rowcount == 0:
+                raise LeaseLostError(f"Lease of {self.filename} was lost by {self.worker_id}")
+
+    def set_stage(self, stage: str) -> None:
+        """Moves the job to the given stage. Finished jobs release their lease and
+        completed stages reset the attempt count."""
+        now = time.time()
+        finished = stage in (INDEXED, FAILED)
+        with connect(self.db_path) as conn:
+            cursor = conn.execute(f"""
+                UPDATE {INGESTION_JOBS_TABLE_NAME}
+                SET stage = ?,
+                    attempts = CASE WHEN ? IN (?, ?) THEN 0 ELSE attempts END,
+                    lease_owner = CASE WHEN ? THEN NULL ELSE lease_owner END,
+                    lease_expires = CASE WHEN ? THEN NULL ELSE ? END,
+                    last_error = CASE WHEN ? THEN NULL ELSE last_error END,
+                    updated_at = ?
+                WHERE filename = ? AND lease_owner = ?
+            """, (stage, stage, PARSED, INDEXED, finished, finished, now + INGESTION_LEASE_SECONDS,
+                  stage == INDEXED, now, self.filename, self.worker_id))
+            if cursor.rowcount == 0:
+                raise LeaseLostError(f"Lease of {self.filename} was lost by {self.worker_id}")
+
+    def register_tasks(self, kind: str, task_keys: Iterable[str]) -> None:
+        """Adds the tasks of a stage, keeping the state of those already known."""
+        now = time.time()
+        with connect(self.db_path) as conn:
+            conn.executemany(f"""
+                INSERT OR IGNORE INTO {INGESTION_TASKS_TABLE_NAME}
+                (filename, kind, task_key, status, updated_at) VALUES (?, ?, ?, ?, ?)
+            """, [(self.filename, kind, task_key, TASK_PENDING, now) for task_key in task_keys])
+
+    def reset_tasks(self, kind: str) -> None:
+        """Forgets the tasks of a stage, when its input changed."""
+        with connect(self.db_path) as conn:
+            conn.execute(
+                f"DELETE FROM {INGESTION_TASKS_TABLE_NAME} WHERE filename = ? AND kind = ?",
+                (self.filename, kind)
+            )
+        self._finished.pop(kind, None)
+
+    def is_task_finished(self, kind: str, task_key: str) -> bool:
+        """Returns True if the task is done, or failed for good."""
+        if kind not in self._finished:
+            with connect(self.db_path) as conn:
+                cursor = conn.execute(f"""
+                    SELECT task_key FROM {INGESTION_TASKS_TABLE_NAME}
+                    WHERE filename = ? AND kind = ? AND status IN (?, ?)
+                """, (self.filename, kind, TASK_DONE, TASK_FAILED))
+                self._finished[kind] = {row[0] for row in cursor.fetchall()}
+        return task_key in self._finished[kind]
+
+    def complete_task(self, kind: str, task_key: str) -> None:
+        """Marks the task done and renews the job lease."""
+        with connect(self.db_path) as conn:
+            conn.execute(f"""
+                INSERT INTO {INGESTION_TASKS_TABLE_NAME} (filename, kind, task_key, status, attempts, updated_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (filename, kind, task_key)
+                DO UPDATE SET status = excluded.status, attempts = attempts + 1,
+                    last_error = NULL, updated_at = excluded.updated_at
+            """, (self.filename, kind, task_key, TASK_DONE, time.time()))
+        if kind in self._finished:
+            self._finished[kind].add(task_key)
+        self.renew_lease()
+
+    def fail_task(self, kind: str, task_key: str, error: str) -> None:
+        """Records a failed attempt of the task. It stays pending for a retry until it
+        has used up INGESTION_MAX_TASK_ATTEMPTS."""
+        with connect(self.db_path) as conn:
+            conn.execute(f"""
+                INSERT INTO {INGESTION_TASKS_TABLE_NAME}
+                (filename, kind, task_key, status, attempts, last_error, updated_at)
+                VALUES (?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (filename, kind, task_key)
+                DO UPDATE SET attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END,
+                    last_error = excluded.last_error, updated_at = excluded.updated_at
+            """, (self.filename, kind, task_key,
+                  TASK_FAILED if INGESTION_MAX_TASK_ATTEMPTS <= 1 else TASK_PENDING,
+                  error, time.time(), INGESTION_MAX_TASK_ATTEMPTS, TASK_FAILED, TASK_PENDING))
+        # The task may have failed for good, reload the finished tasks when needed
+        self._finished.pop(kind, None)
+        self.renew_lease()
+
+    def count_tasks(self, kind: str, status: str) -> int:
+        with connect(self.db_path) as conn:
+            cursor = conn.execute(f"""
+                SELECT COUNT(*) FROM {INGESTION_TASKS_TABLE_NAME}
+                WHERE filename = ? AND kind = ? AND status = ?
+            """, (self.filename, kind, status))
+            return cursor.fetchone()[0]
+
+    def check_stage_complete(self, kind: str) -> None:
+        """Raises IncompleteStageError if tasks of the stage are left to retry.
+        Tasks which used up their attempts are reported and skipped."""
+        pending = self.count_tasks(kind, TASK_PENDING)
+        if pending > 0:
+            raise IncompleteStageError(f"{pending} {kind} task(s) of {self.filename} left to retry")
+        failed = self.count_tasks(kind, TASK_FAILED)
+        if failed > 0:
+            print(f"Skipping {failed} {kind} task(s) of {self.filename} which failed "
+                  f"{INGESTION_MAX_TASK_ATTEMPTS} times")
@@ -0,0 +1,147 @@
+"""This module contains the intent classifier of user queries.
+
+A one-vs-rest logistic regression over the query embedding, which the retrieval
+already computes, so classifying adds almost no latency. It is trained on the policy
+summary sentences and the intents the LLM extracted for them during policy parsing.
+The queries it labels get a narrow intents filtered search with fewer candidates."""
+
+import os
+import glob
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.common import iter_jsonl_records
+from utils.configs import (
+    SUPPORTED_INTENTS,
+    EMBEDDING_BATCH_SIZE,
+    INTENT_CLASSIFIER_PATH,
+    INTENT_CONFIDENCE_THRESHOLD,
+    INTENT_THRESHOLDS,
+    INTENT_MIN_TRAINING_EXAMPLES,
+)
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+class IntentClassifier:
+    """Multi-label intent classifier over sentence embeddings. It keeps only the weights
+    of the trained per intent logistic regressions, so predicting needs numpy alone."""
+
+    def __init__(self, intents: List[str], weights: np.ndarray, bias: np.ndarray,
+                 thresholds: Dict[str, float]):
+        self.intents = list(intents)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.thresholds = np.array([
+            thresholds.get(intent, INTENT_CONFIDENCE_THRESHOLD) for intent in self.intents
+        ])
+
+    def predict_proba(self, vectors) -> np.ndarray:
+        """Returns the confidence of every intent, one row per vector."""
+        logits = np.asarray(vectors, dtype=np.float32) @ self.weights.T + self.bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    def predict(self, vectors) -> List[List[str]]:
+        """Returns the intents whose confidence reaches their threshold, for every vector."""
+        if len(vectors) == 0:
+            return []
+        selected = self.predict_proba(vectors) >= self.thresholds
+        return [
+            [intent for intent, is_selected in zip(self.intents, row) if is_selected]
+            for row in selected
+        ]
+
+    def save(self, path: str) -> None:
+        # Written to a temporary file first, so readers never load a partial model
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, intents=np.array(self.intents), weights=self.weights, bias=self.bias)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with np.load(path) as data:
+            return cls(data["intents"].tolist(), data["weights"], data["bias"], INTENT_THRESHOLDS)
+
+
+def load_training_data(json_dir: str) -> Tuple[List[str], List[List[str]]]:
+    """Reads the summary sentences and their supported intents from the parsed policy
+    JSONL files. Sentences without a supported intent are kept as negative examples,
+    and every intent name is added as an example of itself."""
+    labels_by_text = {}
+    for jsonl_file_path in sorted(glob.glob(os.path.join(json_dir, "*.jsonl"))):
+        for record in iter_jsonl_records(jsonl_file_path):
+            intents = {intent.lower() for intent in record.get("intents", [])} & SUPPORTED_INTENTS
+            for text in record.get("summary", []):
+                labels_by_text.setdefault(text, set()).update(intents)
+    for intent in SUPPORTED_INTENTS:
+        labels_by_text.setdefault(intent, set()).add(intent)
+    texts = list(labels_by_text)
+    return texts, [sorted(labels_by_text[text]) for text in texts]
+
+
+def train_intent_classifier(json_dir: str, model: "SentenceTransformer",
+                            output_path: str = INTENT_CLASSIFIER_PATH) -> Optional[IntentClassifier]:
+    """Trains the intent classifier on the parsed policies and saves it. Returns None if
+    there are too few examples to train on."""
+    # Only the ingestion service trains, the chat app does not need scikit-learn
+    from sklearn.linear_model import LogisticRegression
+
+    texts, labels = load_training_data(json_dir)
+    if len(texts) < INTENT_MIN_TRAINING_EXAMPLES:
+        print(f"Skipping intent classifier training, only {len(texts)} example(s) found.")
+        return None
+
+    start = time.perf_counter()
+    vectors = model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE)
+    intents = sorted(SUPPORTED_INTENTS)
+    weights = np.zeros((len(intents), vectors.shape[1]), dtype=np.float32)
+    bias = np.zeros(len(intents), dtype=np.float32)
+    for i, intent in enumerate(intents):
+        targets = np.array([intent in text_labels for text_labels in labels])
+        if targets.all() or not targets.any():
+            # A single class to learn, the intent is always (or never) predicted
+            bias[i] = 30.0 if targets.all() else -30.0
+            continue
+        # Balanced class weights, as every intent is rare among all the policy sentences
+        regression = LogisticRegression(C=4.0, class_weight="balanced", max_iter=1000)
+        regression.fit(vectors, targets)
+        weights[i], bias[i] = regression.coef_[0], regression.intercept_[0]
+
+    intent_classifier = IntentClassifier(intents, weights, bias, INTENT_THRESHOLDS)
+    intent_classifier.save(output_path)
+    print(f"Trained intent classifier on {len(texts)} examples in {time.perf_counter() - start:.1f}s")
+    return intent_classifier
+
+
+def is_intent_classifier_stale(json_dir: str, model_path: str = INTENT_CLASSIFIER_PATH) -> bool:
+    """Returns True if a parsed policy file is newer than the saved classifier."""
+    jsonl_mtimes = [os.path.getmtime(path) for path in glob.glob(os.path.join(json_dir, "*.jsonl"))]
+    if len(jsonl_mtimes) == 0:
+        return False
+    if not os.path.exists(model_path):
+        return True
+    return max(jsonl_mtimes) > os.path.getmtime(model_path)
+
+
+_loaded = {"mtime": None, "classifier": None}
+
+
+def get_intent_classifier(model_path: str = INTENT_CLASSIFIER_PATH) -> Optional[IntentClassifier]:
+    """Returns the saved intent classifier, reloaded when the ingestion service retrains
+    it. Returns None if no classifier was trained yet."""
+    try:
+        mtime = os.path.getmtime(model_path)
+    except OSError:
+        return None
+    if mtime != _loaded["mtime"]:
+        try:
+            _loaded["classifier"] = IntentClassifier.load(model_path)
+        except Exception as e:
+            print(f"Error loading intent classifier from {model_path}: {e}")
+            _loaded["classifier"] = None
+        _loaded["mtime"] = mtime
+    return _loaded["classifier"]
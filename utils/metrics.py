@@ -0,0 +1,75 @@
+"""This module contains a small in-process metrics registry with counters and timings,
+used to report cache savings and latencies of the app."""
+
+import time
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1.0) -> None:
+    """Adds value to the named counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Records one duration (in seconds) for the named timing."""
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+
+@contextmanager
+def timed(name: str):
+    """Context manager which records the duration of its block for the named timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def get_mean(name: str) -> float:
+    """Returns the mean duration of the named timing, 0.0 if nothing was recorded."""
+    with _lock:
+        timing = _timings.get(name)
+        if not timing or timing["count"] == 0:
+            return 0.0
+        return timing["total"] / timing["count"]
+
+
+def get_metrics() -> Dict[str, Dict]:
+    """Returns a snapshot of all counters and timings."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {
+                name: {**timing, "mean": timing["total"] / timing["count"] if timing["count"] else 0.0}
+                for name, timing in _timings.items()
+            },
+        }
+
+
+def print_metrics() -> None:
+    """Prints all counters and timings."""
+    snapshot = get_metrics()
+    for name, value in sorted(snapshot["counters"].items()):
+        print(f"{name}: {value:g}")
+    for name, timing in sorted(snapshot["timings"].items()):
+        print(f"{name}: count={timing['count']} mean={timing['mean'] * 1000:.2f}ms "
+              f"max={timing['max'] * 1000:.2f}ms")
+
+
+def reset_metrics() -> None:
+    """Clears all counters and timings."""
+    with _lock:
+        _counters.clear()
+        _timings.clear()
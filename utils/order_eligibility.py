@@ -0,0 +1,68 @@
+"""This module contains the order eligibility view, which the chat app reads the order
+details from. The order data service (re)creates it, the chat app only checks for it,
+so this module needs no pandas."""
+
+import sqlite3
+
+from utils.configs import (
+  DB_PATH,
+  ORDER_ELIGIBILITY_VIEW_NAME,
+  ORDER_STATUSES,
+  RETURN_WINDOW_DAYS,
+  EXCHANGE_WINDOW_DAYS,
+  DAMAGE_REPORT_WINDOW_DAYS
+)
+
+def create_eligibility_view(cursor: sqlite3.Cursor, table_name: str) -> None:
+  """
+  (Re)creates the view with the return, exchange and damage report eligibility of
+  every order, from the policy windows in the configuration. Days are counted from
+  the order date up to the current local date. Rows whose derived columns are not
+  filled in yet fall back to the raw columns.
+  """
+  statuses = ", ".join(f"'{status}'" for status in sorted(ORDER_STATUSES))
+  order_date = "COALESCE(order_date_iso, date(order_date))"
+  order_epoch_day = "COALESCE(order_epoch_day, CAST(julianday(date(order_date)) - 2440587.5 AS INTEGER))"
+  is_final_sale = "COALESCE(is_final_sale, lower(trim(final_sale)) IN ('yes', 'true', '1'))"
+  status_code = (
+      f"COALESCE(status_code, CASE WHEN lower(trim(status)) IN ({statuses}) "
+      f"THEN lower(trim(status)) ELSE 'unknown' END)"
+  )
+  days_since_order = f"(CAST(julianday(date('now', 'localtime')) - 2440587.5 AS INTEGER) - {order_epoch_day})"
+  cursor.execute(f"DROP VIEW IF EXISTS {ORDER_ELIGIBILITY_VIEW_NAME}")
+  cursor.execute(f"""
+      CREATE VIEW {ORDER_ELIGIBILITY_VIEW_NAME} AS
+      SELECT
+          order_id, product_category, product_name, size, quantity, `price_(usd)`,
+          order_date, status, payment_method, shipping_address, is_final_sale,
+          days_since_order,
+          (status = 'delivered' AND is_final_sale = 0
+              AND days_since_order <= {RETURN_WINDOW_DAYS}) AS return_eligible,
+          (status = 'delivered' AND is_final_sale = 0
+              AND days_since_order <= {EXCHANGE_WINDOW_DAYS}) AS exchange_eligible,
+          (status = 'delivered' AND days_since_order <= {DAMAGE_REPORT_WINDOW_DAYS}) AS damage_report_eligible,
+          CASE WHEN status = 'delivered' AND is_final_sale = 0 AND days_since_order <= {RETURN_WINDOW_DAYS}
+              THEN {RETURN_WINDOW_DAYS} - days_since_order ELSE 0 END AS days_left_to_return,
+          CASE
+              WHEN is_final_sale = 1 THEN 'final sale items cannot be returned or exchanged'
+              WHEN status != 'delivered' THEN 'order is not delivered yet (status: ' || status || ')'
+              WHEN days_since_order > {RETURN_WINDOW_DAYS} THEN 'the {RETURN_WINDOW_DAYS} day return window has passed'
+          END AS return_ineligibility_reason
+      FROM (
+          SELECT
+              order_id, product_category, product_name, size, quantity, `price_(usd)`,
+              {order_date} AS order_date, {status_code} AS status, payment_method, shipping_address,
+              {is_final_sale} AS is_final_sale, {days_since_order} AS days_since_order
+          FROM {table_name}
+      )
+  """)
+
+def eligibility_view_exists(db_path: str = DB_PATH) -> bool:
+  """
+  Returns True if the order data service has created the eligibility view.
+  """
+  with sqlite3.connect(db_path, timeout=30) as conn:
+      cursor = conn.execute(
+          "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?", (ORDER_ELIGIBILITY_VIEW_NAME,)
+      )
+      return cursor.fetchone() is not None
@@ -5,12 +5,63 @@ import sqlite3
 import time
 from datetime import datetime
 
+from utils.configs import (
+  ORDER_CHANGES_TABLE_NAME,
+  ORDER_STATUSES
+)
+from utils.order_eligibility import create_eligibility_view
+
 def standardize_column_name(column_name):
     return column_name.strip().lower().replace(' ', '_')
 
+def record_order_changes(cursor: sqlite3.Cursor, order_ids: list) -> None:
+  """
+  Appends the given order IDs to the order change log, which the chat app polls to
+  invalidate its cached tool results.
+  """
+  cursor.execute(f"""
+      CREATE TABLE IF NOT EXISTS {ORDER_CHANGES_TABLE_NAME} (
+          change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+          order_id INTEGER,
+          changed_at TEXT
+      )
+  """)
+  changed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+  cursor.executemany(
+      f"INSERT INTO {ORDER_CHANGES_TABLE_NAME} (order_id, changed_at) VALUES (?, ?)",
+      [(int(order_id), changed_at) for order_id in order_ids]
+  )
+
+def add_derived_order_columns(df: pd.DataFrame) -> pd.DataFrame:
+  """
+  Adds the normalized, typed columns derived from the raw order columns, so they are
+  computed once at ingestion instead of on every query: the ISO order date, the order
+  date in days since the epoch, final sale as 0/1 and the lower case status.
+  """
+  order_dates = pd.to_datetime(df['order_date']).dt.normalize()
+  df['order_date_iso'] = order_dates.dt.strftime('%Y-%m-%d')
+  df['order_epoch_day'] = (order_dates - pd.Timestamp('1970-01-01')).dt.days
+  df['is_final_sale'] = df['final_sale'].astype(str).str.strip().str.lower().isin(['yes', 'true', '1']).astype(int)
+  status = df['status'].astype(str).str.strip().str.lower()
+  df['status_code'] = status.where(status.isin(ORDER_STATUSES), 'unknown')
+  return df
+
+def add_missing_columns(cursor: sqlite3.Cursor, table_name: str, df: pd.DataFrame) -> None:
+  """
+  Adds the columns of the DataFrame missing in an existing table. Their values are
+  filled in by the delta update, which sees the rows as changed.
+  """
+  cursor.execute(f"PRAGMA table_info({table_name})")
+  existing_columns = {row[1] for row in cursor.fetchall()}
+  for column in df.columns:
+      if column not in existing_columns:
+          cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN `{column}`")
+
 def excel_to_sqlite_delta(excel_file: str, db_file: str, table_name: str, unique_key: str):
   """
-  Reads an Excel file and updates an SQLite database with new records only.
+  Reads an Excel file and updates an SQLite database with new and changed records only.
+  The derived order columns are stored along with the raw ones, and the eligibility
+  view is refreshed. Every added or updated record is written to the order change log.
 
   :param excel_file: Path to the Excel file.
   :param db_file: Path to the SQLite database file.
@@ -21,6 +72,9 @@ def excel_to_sqlite_delta(excel_file: str, db_file: str, table_name: str, unique
       # Load Excel file into DataFrame
       df = pd.read_excel(excel_file)
       df.columns = df.columns.map(standardize_column_name)
+      df = add_derived_order_columns(df)
+      staging_table = f"{table_name}_staging"
+      columns = ", ".join(f"`{column}`" for column in df.columns)
 
       # Connect to SQLite database
       with sqlite3.connect(db_file) as conn:
@@ -28,19 +82,44 @@ def excel_to_sqlite_delta(excel_file: str, db_file: str, table_name: str, unique
 
         # Create table if not exists
         df.head(0).to_sql(table_name, conn, if_exists='append', index=False)
+        add_missing_columns(cursor, table_name, df)
+        create_eligibility_view(cursor, table_name)
+
+        # Stage the Excel data so that it is compared in its stored SQLite form
+        df.to_sql(staging_table, conn, if_exists='replace', index=False)
 
-        # Fetch existing unique keys
-        cursor.execute(f"SELECT {unique_key} FROM {table_name}")
-        existing_keys = set(row[0] for row in cursor.fetchall())
+        # Fetch new unique keys
+        cursor.execute(f"""
+            SELECT {unique_key} FROM {staging_table}
+            WHERE {unique_key} NOT IN (SELECT {unique_key} FROM {table_name})
+        """)
+        new_keys = [row[0] for row in cursor.fetchall()]
 
-        # Filter out already existing records
-        new_data = df[~df[unique_key].isin(existing_keys)]
+        # Fetch unique keys of existing records whose values changed
+        differences = " OR ".join(f"s.`{column}` IS NOT t.`{column}`" for column in df.columns)
+        cursor.execute(f"""
+            SELECT s.{unique_key} FROM {staging_table} s
+            JOIN {table_name} t ON s.{unique_key} = t.{unique_key}
+            WHERE {differences}
+        """)
+        changed_keys = [row[0] for row in cursor.fetchall()]
 
-        if not new_data.empty:
-            new_data.to_sql(table_name, conn, if_exists='append', index=False)
-            print(f"Added {len(new_data)} new records to {table_name}")
+        if changed_keys:
+            cursor.executemany(
+                f"DELETE FROM {table_name} WHERE {unique_key} = ?",
+                [(key,) for key in changed_keys]
+            )
+        if new_keys or changed_keys:
+            cursor.executemany(
+                f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {staging_table} WHERE {unique_key} = ?",
+                [(key,) for key in new_keys + changed_keys]
+            )
+            record_order_changes(cursor, new_keys + changed_keys)
+            print(f"Added {len(new_keys)} new records and updated {len(changed_keys)} records in {table_name}")
         else:
             print("No new records to add.")
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+        conn.commit()
   except Exception as e:
       import os
       print(os.getcwd())
@@ -1,102 +1,113 @@
 """This module contains utility functions for ingesting policy documents."""
 
-import os
-import time
-import sqlite3
 import hashlib
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone, ServerlessSpec
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from pinecone import Pinecone
 
 from utils.configs import (
-   POLICY_TABLE_NAME
+   UPSERT_BATCH_SIZE
 )
+from utils.embedding_service import EmbeddingService
+from utils.sentence_store import save_sentences, encode_intents, decode_intents
+from utils.ingestion_jobs import JobProgress, LeaseLostError
 
 def generate_id_for_text(text: str) -> str:
     """Generates a deterministic ID for a given text."""
     return hashlib.sha256(text.encode()).hexdigest()
 
-def collate_json_data(data: List[Dict]) -> List[Dict]:
-    """Collates data from a list of JSON objects."""
-    collated_data = {}
+def collate_json_data(data: Iterable[Dict]) -> Iterator[Dict]:
+    """Collates the summary sentences of a stream of JSON objects into records keyed by
+    text ID. A record is yielded when its text is first seen, and again only if a later
+    object adds new intents to it (the upsert merges them with the stored intents)."""
+    seen_intents = {}
     for item in data:
+        intents = set(map(str.lower, item['intents']))
         for text in item['summary']:
             text = text.lower()
             text_id = generate_id_for_text(text)
-            if text_id not in collated_data:
-                collated_data[text_id] = {
-                    'id': text_id,
-                    'text': text,
-                    'intents': []
-                }
-            intents = list(set(map(str.lower, item['intents'])))
-            collated_data[text_id]['intents'].extend(intents)
-    return list(collated_data.values())
+            new_intents = intents - seen_intents.get(text_id, set())
+            if text_id in seen_intents and not new_intents:
+                continue
+            seen_intents.setdefault(text_id, set()).update(new_intents)
+            yield {
+                'id': text_id,
+                'text': text,
+                'intents': sorted(new_intents),
+                'line_no': item.get('line_no')
+            }
 
-def create_or_load_pinecone_index(index_name: str, embedding_dims: int) -> Pinecone.Index:
-    """Creates or loads a Pinecone index."""
-    pinecone_api_key = os.environ.get("PINECONE_API_KEY")
-    pc = Pinecone(api_key=pinecone_api_key)
+def upsert_batch(index: Pinecone.Index, batch: List[Dict], model: EmbeddingService) -> int:
+    """Encodes and upserts one batch of records, merging intents with the stored ones.
+    Returns the number of records that were already in the index."""
+    ids = [record['id'] for record in batch]
+    existing_vectors = index.fetch(ids).vectors
+    embeddings = model.encode([record['text'] for record in batch]).tolist()
+    # Texts go to the local sentence store before their vectors can be found
+    save_sentences(batch)
+    vectors = []
+    for record, embedding in zip(batch, embeddings):
+        intents = record['intents']
+        if record['id'] in existing_vectors:
+            intents = decode_intents(existing_vectors[record['id']]['metadata'].get('intents', [])) + intents
+        vectors.append({
+            'id': record['id'],
+            'values': embedding,
+            # Only the intent codes are kept, the text is hydrated from the sentence store
+            'metadata': {'intents': sorted(encode_intents(intents, add=True))}
+        })
+    index.upsert(vectors=vectors)
+    return len([record_id for record_id in ids if record_id in existing_vectors])
 
-    if not pc.has_index(index_name):
-        pc.create_index(
-            name=index_name,
-            dimension=embedding_dims,
-            metric="cosine",
-            spec=ServerlessSpec(
-                cloud="aws",
-                region="us-east-1"
-            ),
-        )
-        while not pc.describe_index(index_name).status["ready"]:
-            time.sleep(1)
-        print(f"Index {index_name} is ready")
-    else:
-        print(f"Index {index_name} already exists")
-    return pc.Index(index_name)
+def merge_duplicate_records(batch: List[Dict]) -> List[Dict]:
+    """Merges the intents of records repeated inside one batch, as a batch upsert keeps
+    only one of them."""
+    merged = {}
+    for record in batch:
+        if record['id'] in merged:
+            merged[record['id']]['intents'] = sorted(set(merged[record['id']]['intents'] + record['intents']))
+        else:
+            merged[record['id']] = dict(record)
+    return list(merged.values())
 
-def process_and_upsert_data(index: Pinecone.Index, collated_data: List[Dict], model: SentenceTransformer) -> None:
-    """Processes and upserts data to Pinecone index."""
+def iter_batches(records: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+    """Groups a stream of records into lists of batch_size records."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_and_upsert_data(index: Pinecone.Index, collated_data: Iterable[Dict], model: EmbeddingService,
+                            batch_size: int = UPSERT_BATCH_SIZE,
+                            progress: Optional[JobProgress] = None) -> Tuple[int, int, int]:
+    """Processes and upserts a stream of records to Pinecone index in batches. A failed
+    batch is reported and does not stop the others. With a job progress, every batch is
+    recorded as a task and batches finished in an earlier run are skipped.
+    Returns the inserted, upserted and failed record counts."""
     inserted_count = 0
     upserted_count = 0
-    for record in collated_data:
+    failed_count = 0
+    for batch_no, batch in enumerate(iter_batches(collated_data, batch_size)):
+        task_key = str(batch_no)
+        if progress is not None and progress.is_task_finished('batch', task_key):
+            continue
+        records = merge_duplicate_records(batch)
         try:
-            response = index.fetch([record['id']])
-            if record['id'] in response.vectors:
-                existing_metadata = response.vectors[record['id']]['metadata']
-                existing_metadata['intents'] = list(set(existing_metadata['intents']+record['intents']))
-                index.upsert(vectors=[{
-                    'id': record['id'],
-                    'values': model.encode(record['text']).tolist(),
-                    'metadata': existing_metadata
-                }])
-                upserted_count += 1
-            else:
-                index.upsert(vectors=[{
-                    'id': record['id'],
-                    'values': model.encode(record['text']).tolist(),
-                    'metadata': {
-                        'text': record['text'],
-                        'intents': record['intents']
-                    }
-                }])
-                inserted_count += 1
+            existing_count = upsert_batch(index, records, model)
+        except LeaseLostError:
+            raise
         except Exception as e:
-            print(f"Error processing record {record['id']}: {e}")
-    print(f"Inserted {inserted_count} records, Upserted {upserted_count} records")
-    assert inserted_count + upserted_count == len(collated_data), "Inserted + upserted do not match total data"
-
-def update_database_status(db_path: str, filename: str, status: str) -> None:
-    """Updates the database status."""
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute(f"UPDATE {POLICY_TABLE_NAME} SET status = ? WHERE filename = ?", (status, filename))
-        conn.commit()
-
-def get_files_to_process(db_path: str) -> List[str]:
-    """Returns a list of filenames with status 'parsing done'."""
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT filename FROM {POLICY_TABLE_NAME} WHERE status = ?", ('parsing done',))
-        filenames = [row[0] for row in cursor.fetchall()]
-    return filenames
\ No newline at end of file
+            print(f"Error processing batch {batch_no}: {e}")
+            failed_count += len(records)
+            if progress is not None:
+                progress.fail_task('batch', task_key, str(e))
+            continue
+        upserted_count += existing_count
+        inserted_count += len(records) - existing_count
+        if progress is not None:
+            progress.complete_task('batch', task_key)
+    print(f"Inserted {inserted_count} records, Upserted {upserted_count} records, Failed {failed_count} records")
+    return inserted_count, upserted_count, failed_count
@@ -2,7 +2,7 @@
 
 import re, os
 import json
-import sqlite3
+from functools import lru_cache
 import pymupdf4llm
 from langchain_text_splitters import MarkdownHeaderTextSplitter
 from langchain_groq import ChatGroq
@@ -10,12 +10,25 @@ from textwrap import dedent
 
 from utils.configs import (
     POLICY_PARSING_MODEL_NAME,
-    POLICY_TABLE_NAME
+    PARSING_CHUNK_TARGET_TOKENS,
+    PARSING_CHUNK_MAX_TOKENS,
+    PARSING_CHUNK_OVERLAP_SENTENCES,
+    PARSING_CHARS_PER_TOKEN
+)
+from utils.resilience import get_dependency
+from utils.policy_ingestion import generate_id_for_text
+from utils.ingestion_jobs import LeaseLostError
+from utils.common import (
+    get_jsonl_file_path,
+    repair_jsonl_tail,
+    append_jsonl_record,
+    iter_jsonl_records
 )
 
 def split_text_into_subsections(text):
     """
-    Splits text into subsections using MarkdownHeaderTextSplitter.
+    Splits text into subsections using MarkdownHeaderTextSplitter. Every subsection is
+    returned with the breadcrumb of the headers it belongs to, as (breadcrumb, text).
     """
     headers_to_split_on = [("#", "Header 1"), ("##", "Header 2"), ("###", "Header 3"), ("**", "Header 4")]
     markdown_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
@@ -23,90 +36,244 @@ def split_text_into_subsections(text):
     document_headers = markdown_splitter.split_text(text)
     document_subsections = []
     for doc_head in document_headers:
+        breadcrumb = " > ".join(
+            doc_head.metadata[name] for _, name in headers_to_split_on if name in doc_head.metadata
+        )
         sub_sections = sub_sections_pattern.split(doc_head.page_content)
         sub_sections = [ss.strip() for ss in sub_sections if ss.strip()]
-        document_subsections.extend(sub_sections)
+        document_subsections.extend((breadcrumb, ss) for ss in sub_sections)
     return document_subsections
 
-def process_subsections_with_llm(document_subsections):
-    """ Given a document subsection return the intents and summary """
+@lru_cache(maxsize=1)
+def get_token_encoding():
+    """ Returns the tiktoken encoding used to estimate token counts, or None if it
+    cannot be loaded (it is downloaded on first use) """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Estimating token counts from text length, tiktoken unavailable: {e}")
+        return None
+
+def count_tokens(text):
+    """ Estimates the number of tokens of the text. The parsing model has its own
+    tokenizer, so this is only an approximation for sizing the chunks """
+    encoding = get_token_encoding()
+    if encoding is None:
+        return len(text) // PARSING_CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def split_long_sentence(sentence, target_tokens):
+    """ Hard-splits a sentence longer than target_tokens on token boundaries, or on
+    character boundaries of the same estimate when tiktoken is unavailable """
+    encoding = get_token_encoding()
+    if encoding is None:
+        size = max(1, (target_tokens - 1) * PARSING_CHARS_PER_TOKEN)
+        return [sentence[i:i + size] for i in range(0, len(sentence), size)]
+    tokens = encoding.encode(sentence, disallowed_special=())
+    return [encoding.decode(tokens[i:i + target_tokens]) for i in range(0, len(tokens), target_tokens)]
+
+def split_oversized_subsection(text, target_tokens, overlap_sentences):
+    """ Splits a subsection on sentence boundaries into parts of up to target_tokens,
+    each part starting with the last overlap_sentences sentences of the previous one.
+    Sentences longer than target_tokens are hard-split, and the overlap is cut short
+    where it would push a part over target_tokens """
+    sentences = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        if not sentence.strip():
+            continue
+        if count_tokens(sentence) > target_tokens:
+            sentences.extend(split_long_sentence(sentence, target_tokens))
+        else:
+            sentences.append(sentence)
+    parts = []
+    # (sentence, tokens) pairs, the tokens include the space joining the sentence
+    current, current_tokens = [], 0
+    for sentence in sentences:
+        sentence_tokens = count_tokens(sentence) + 1
+        if current and current_tokens + sentence_tokens > target_tokens:
+            parts.append(" ".join(s for s, _ in current))
+            current = current[-overlap_sentences:] if overlap_sentences > 0 else []
+            while current and sum(t for _, t in current) + sentence_tokens > target_tokens:
+                current.pop(0)
+            current_tokens = sum(t for _, t in current)
+        current.append((sentence, sentence_tokens))
+        current_tokens += sentence_tokens
+    if current:
+        parts.append(" ".join(s for s, _ in current))
+    return parts
+
+def render_chunk(pieces):
+    """ Joins (breadcrumb, text) pieces into a chunk of numbered sections, each starting
+    with a "Section <number>: <breadcrumb>" line. The LLM returns the intents and summary
+    of every section separately, so packed sections do not share their intents """
+    lines = []
+    for number, (breadcrumb, text) in enumerate(pieces, start=1):
+        lines.append(f"Section {number}: {breadcrumb}".rstrip())
+        lines.append(text)
+    return "\n".join(lines)
+
+def pack_subsections_into_chunks(document_subsections,
+                                 target_tokens=PARSING_CHUNK_TARGET_TOKENS,
+                                 max_tokens=PARSING_CHUNK_MAX_TOKENS,
+                                 overlap_sentences=PARSING_CHUNK_OVERLAP_SENTENCES):
+    """ Packs adjacent small subsections into chunks of up to target_tokens, and splits
+    the subsections larger than max_tokens on sentence boundaries with overlap. Fewer,
+    evenly sized chunks mean fewer LLM calls, each well within the output token limit """
+    pieces = []
+    for breadcrumb, text in document_subsections:
+        if count_tokens(text) > max_tokens:
+            # Leave room for the section line, so every part fits in a chunk
+            part_tokens = max(1, target_tokens - count_tokens(breadcrumb) - 4)
+            pieces.extend(
+                (breadcrumb, part) for part in split_oversized_subsection(text, part_tokens, overlap_sentences)
+            )
+        else:
+            pieces.append((breadcrumb, text))
+
+    chunks = []
+    current, current_tokens = [], 0
+    for breadcrumb, text in pieces:
+        # Plus the "Section <number>: <breadcrumb>" line of the piece
+        piece_tokens = count_tokens(text) + count_tokens(breadcrumb) + 4
+        if current and current_tokens + piece_tokens > target_tokens:
+            chunks.append(render_chunk(current))
+            current, current_tokens = [], 0
+        current.append((breadcrumb, text))
+        current_tokens += piece_tokens
+    if current:
+        chunks.append(render_chunk(current))
+    return chunks
+
+def get_chunk_stats(document_subsections, chunks):
+    """ Returns the chunk count and token sizes of a document, for reporting """
+    chunk_tokens = [count_tokens(chunk) for chunk in chunks]
+    return {
+        "subsections": len(document_subsections),
+        "chunks": len(chunks),
+        "total_tokens": sum(chunk_tokens),
+        "min_tokens": min(chunk_tokens, default=0),
+        "mean_tokens": sum(chunk_tokens) / len(chunk_tokens) if chunk_tokens else 0,
+        "max_tokens": max(chunk_tokens, default=0),
+    }
+
+def load_processed_subsection_ids(jsonl_file_path):
+    """ Return the IDs of the chunks whose section records are all saved in the JSONL
+    file. Records of earlier versions, one per chunk, have no section numbers """
+    if not os.path.exists(jsonl_file_path):
+        return set()
+    repair_jsonl_tail(jsonl_file_path)
+    saved_sections = {}
+    sections_counts = {}
+    for record in iter_jsonl_records(jsonl_file_path):
+        saved_sections.setdefault(record['subsection_id'], set()).add(record.get('section', 1))
+        sections_counts[record['subsection_id']] = record.get('sections_count', 1)
+    return {
+        subsection_id for subsection_id, sections in saved_sections.items()
+        if len(sections) >= sections_counts[subsection_id]
+    }
+
+def parse_section_records(response_content):
+    """ Returns the {intents, summary} record of every section from the LLM response.
+    A single {intents, summary} object is taken as the record of the whole chunk """
+    json_response = json.loads(response_content)
+    if "sections" not in json_response:
+        return [{"intents": json_response["intents"], "summary": json_response["summary"]}]
+    return [
+        {"intents": section["intents"], "summary": section["summary"]}
+        for section in json_response["sections"]
+    ]
+
+def process_subsections_with_llm(document_subsections, jsonl_file_path, progress=None):
+    """Given the document chunks, extract the intents and summary of each section of
+    every chunk and append them to the JSONL file as the LLM returns them. Chunks
+    already in the file (from an earlier, interrupted run) are skipped. With a job
+    progress, every chunk is tracked as a task and those finished earlier are skipped
+    as well. Returns the number of records saved."""
     chat = ChatGroq(
         model_name=POLICY_PARSING_MODEL_NAME,
         temperature=0.1,
         api_key=os.getenv('GROQ_API_KEY'),
-        max_tokens=2048
+        max_tokens=2048,
+        max_retries=0
       )
     messages = [
         {
             "role": "system",
             "content": dedent("""
             Think like a good customer service agent in E-commerce business and follow the below instructions as it is:
-              1. Extract the main intent covered in the text in one or two words. For ex - refund, replacement, etc.
-                Add multiple intents as applicable for the text, but not more than top 5.
-              2. Summarize the text into a list of very short sentences without loosing any critical info. Do not repeat same sentences.
-              3. Provide the collated output strictly in JSON format as shown below. Just give the output without any extra text or explanation.
+              1. The text is split into numbered sections, each starting with a line "Section <number>: <section names>".
+                The section names are the document headers of the section, use them as context only. Handle every section separately.
+              2. For each section, extract the main intent covered in its text in one or two words. For ex - refund, replacement, etc.
+                Add multiple intents as applicable for the section, but not more than top 5.
+              3. For each section, summarize its text into a list of very short sentences without loosing any critical info. Do not repeat same sentences.
+              4. Provide the output strictly in JSON format as shown below, with one entry for every section, in order. Just give the output without any extra text or explanation.
               {
-                "intents": ["intent 1", "intent 2", ...],
-                "summary": ["short sentence 1", "sentence 2", ...]
+                "sections": [
+                  {"section": 1, "intents": ["intent 1", "intent 2", ...], "summary": ["short sentence 1", "sentence 2", ...]},
+                  ...
+                ]
               }
             """)
         }
     ]
-    json_responses = []
-    for document_subsection in document_subsections:
-        current_messages = messages + [{"role": "user", "content": document_subsection}]
-        try:
-            response = chat.invoke(current_messages)
-            json_responses.append(json.loads(response.content))
-        except Exception as e:
-            print(f"Error processing subsection with LLM: {e}")
-    return json_responses
+    subsection_ids = [generate_id_for_text(subsection) for subsection in document_subsections]
+    if progress is not None:
+        progress.register_tasks('subsection', subsection_ids)
+    processed_ids = load_processed_subsection_ids(jsonl_file_path)
+    if processed_ids:
+        print(f"Resuming {jsonl_file_path}, {len(processed_ids)} subsection(s) already processed")
+    records_count = 0
+    with open(jsonl_file_path, 'a') as f:
+        for document_subsection, subsection_id in zip(document_subsections, subsection_ids):
+            if progress is not None and progress.is_task_finished('subsection', subsection_id):
+                continue
+            if subsection_id in processed_ids:
+                # Saved before the worker stopped, but not yet marked as done
+                if progress is not None:
+                    progress.complete_task('subsection', subsection_id)
+                continue
+            current_messages = messages + [{"role": "user", "content": document_subsection}]
+            try:
+                response = get_dependency("groq_policy_parsing").call(chat.invoke, current_messages)
+                section_records = parse_section_records(response.content)
+                # One record per section, the chunk counts as processed once all are saved
+                for section, section_record in enumerate(section_records, start=1):
+                    append_jsonl_record(f, {
+                        "subsection_id": subsection_id,
+                        "section": section,
+                        "sections_count": len(section_records),
+                        **section_record
+                    })
+            except LeaseLostError:
+                raise
+            except Exception as e:
+                print(f"Error processing subsection with LLM: {e}")
+                if progress is not None:
+                    progress.fail_task('subsection', subsection_id, str(e))
+                continue
+            processed_ids.add(subsection_id)
+            records_count += len(section_records)
+            if progress is not None:
+                progress.complete_task('subsection', subsection_id)
+    return records_count
 
-def save_processed_filename(filename, db_path, json_responses, json_output_dir):
-    """ Save the json file and processed filename to the database """
-    try:
-        json_filename = os.path.splitext(filename)[0] + '.json'
-        json_file_path = os.path.join(json_output_dir, json_filename)
-        with open(json_file_path, 'w') as f:
-            json.dump(json_responses, f, indent=2)
-        print(f"Saved JSON file: {json_file_path}")
-
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(f"INSERT OR IGNORE INTO {POLICY_TABLE_NAME} (filename, status) VALUES (?, ?)", (filename, 'parsing done'))
-            conn.commit()
-        print(f"Saved processed filename: {filename}")
-    except Exception as e:
-        print(f"Error saving processed filename: {e}")
-
-def check_file_processed(filename, db_path):
-    """ Check if a file has already been processed """
-    try:
-        flag = None
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(f'''CREATE TABLE IF NOT EXISTS {POLICY_TABLE_NAME} (filename TEXT UNIQUE, status TEXT)''')
-            cursor.execute(f"SELECT 1 FROM {POLICY_TABLE_NAME} WHERE filename = ?", (filename,))
-            if cursor.fetchone():
-                flag = True
-            else:
-                flag = False
-    except Exception as e:
-        print(f"Error checking file processed: {e}")
-        flag = False
-    return flag
-
-def process_pdf_file(pdf_file_path, db_path, json_output_dir):
-    """ Process a PDF file and return the processed
-    data in JSON format """
+def process_pdf_file(pdf_file_path, json_output_dir, progress=None):
+    """ Process a PDF file into a JSONL file of intents and summaries
+    and return the number of records saved """
     filename = os.path.basename(pdf_file_path)
     text = pymupdf4llm.to_markdown(pdf_file_path)
     if text:
         document_subsections = split_text_into_subsections(text)
-        json_responses = process_subsections_with_llm(document_subsections)
-        save_processed_filename(filename, db_path, json_responses, json_output_dir)
+        chunks = pack_subsections_into_chunks(document_subsections)
+        stats = get_chunk_stats(document_subsections, chunks)
+        print(f"Chunked {filename}: {stats['subsections']} subsections into {stats['chunks']} chunks, "
+              f"{stats['total_tokens']} tokens (min {stats['min_tokens']}, "
+              f"mean {stats['mean_tokens']:.0f}, max {stats['max_tokens']})")
+        jsonl_file_path = get_jsonl_file_path(filename, json_output_dir)
+        records_count = process_subsections_with_llm(chunks, jsonl_file_path, progress)
+        print(f"Saved JSONL file: {jsonl_file_path}")
     else:
         print(f"No text extracted from file: {filename}")
-        json_responses = []
-    return json_responses
-
+        records_count = 0
+    return records_count
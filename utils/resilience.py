@@ -0,0 +1,286 @@
+"""This module contains the resilience layer used around calls to remote services
+(Pinecone query and rerank, Groq chat). It provides per-dependency timeouts,
+jittered retries, hedged requests and circuit breakers, plus a fault injecting
+stand-in which can replace any remote call while testing locally."""
+
+import time
+import random
+import threading
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+    wait,
+    FIRST_COMPLETED,
+)
+from typing import Any, Callable, Dict, Optional, Type
+
+from utils.configs import (
+    DEPENDENCY_POLICIES,
+    RESILIENCE_POOL_SIZE,
+)
+
+# Shared pool used to enforce timeouts and run hedged attempts. A timed out call
+# cannot be killed, it is only abandoned and finishes in the background.
+_executor = ThreadPoolExecutor(
+    max_workers=RESILIENCE_POOL_SIZE,
+    thread_name_prefix="resilience"
+)
+
+
+class DependencyTimeoutError(Exception):
+    """Raised when a remote call does not finish within its timeout."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+def call_with_timeout(func: Callable, timeout: Optional[float], *args, **kwargs) -> Any:
+    """Runs the function and raises DependencyTimeoutError if it takes longer than timeout."""
+    if timeout is None:
+        return func(*args, **kwargs)
+    future = _executor.submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise DependencyTimeoutError(
+            f"{getattr(func, '__name__', 'call')} timed out after {timeout}s"
+        )
+
+
+def hedged_call(func: Callable, hedge_delay: float, timeout: Optional[float],
+                *args, max_hedges: int = 1, **kwargs) -> Any:
+    """Runs the function and, if it has not answered after hedge_delay seconds, fires
+    another identical request. The first successful answer wins."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pending = {_executor.submit(func, *args, **kwargs)}
+    hedges_left = max_hedges
+    last_error = None
+
+    while pending:
+        if hedges_left > 0:
+            wait_time = hedge_delay
+        else:
+            wait_time = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_time = remaining if wait_time is None else min(wait_time, remaining)
+
+        done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return future.result()
+            last_error = future.exception()
+
+        # Fire a hedge when the current attempts are slow or have all failed
+        if hedges_left > 0 and (not done or not pending):
+            pending.add(_executor.submit(func, *args, **kwargs))
+            hedges_left -= 1
+
+    for future in pending:
+        future.cancel()
+    if last_error is not None and not pending:
+        raise last_error
+    raise DependencyTimeoutError(
+        f"{getattr(func, '__name__', 'call')} timed out after {timeout}s"
+    )
+
+
+def is_transient_error(ex: BaseException) -> bool:
+    """Returns True for the errors worth retrying: timeouts, connection errors, rate
+    limiting (429) and server errors (5xx). Client errors (auth, bad requests, failed
+    tool calls) fail the same way on every attempt."""
+    if isinstance(ex, (DependencyTimeoutError, TimeoutError, ConnectionError)):
+        return True
+    # Groq errors carry the HTTP status as status_code, Pinecone errors as status
+    status = getattr(ex, "status_code", None) or getattr(ex, "status", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # Client library errors without a status, ex - groq.APIConnectionError, urllib3 timeouts
+    return any("Timeout" in cls.__name__ or "Connection" in cls.__name__ for cls in type(ex).__mro__)
+
+
+def retry_with_jitter(func: Callable, attempts: int, base_delay: float, max_delay: float,
+                      is_retryable: Callable[[BaseException], bool] = is_transient_error) -> Any:
+    """Calls func() up to attempts times, sleeping with full jitter exponential
+    backoff between retryable failures. The last error is re-raised."""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as ex:
+            if attempt == attempts - 1 or not is_retryable(ex):
+                raise
+            backoff = min(max_delay, base_delay * (2 ** attempt))
+            time.sleep(random.uniform(0, backoff))
+
+
+class CircuitBreaker:
+    """Circuit breaker for a single remote dependency.
+
+    The circuit opens after failure_threshold consecutive failures and rejects calls
+    for reset_timeout seconds. After that one trial call is let through (half open);
+    its outcome closes or re-opens the circuit."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and \
+                    time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Returns True if a call may be attempted now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half open, allow a single trial call
+            if self._trial_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                print(f"Circuit '{self.name}' closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print(f"Circuit '{self.name}' opened after {self._failures} failure(s)")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ResilientDependency:
+    """Wraps calls to one remote dependency with its timeout, retry, hedging and
+    circuit breaker settings."""
+
+    def __init__(self, name: str, timeout: Optional[float] = None, attempts: int = 1,
+                 base_delay: float = 0.2, max_delay: float = 2.0,
+                 hedge_delay: Optional[float] = None, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.name = name
+        self.timeout = timeout
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_delay = hedge_delay
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    def _attempt(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        if self.hedge_delay is not None:
+            return hedged_call(func, self.hedge_delay, self.timeout, *args, **kwargs)
+        return call_with_timeout(func, self.timeout, *args, **kwargs)
+
+    def call(self, func: Callable, *args, fallback: Optional[Callable] = None, **kwargs) -> Any:
+        """Calls func(*args, **kwargs) through the resilience policy.
+
+        If the circuit is open or every attempt fails, fallback() is returned when
+        given, otherwise the error is raised."""
+        if not self.breaker.allow_request():
+            if fallback is not None:
+                print(f"Circuit '{self.name}' is open, using fallback")
+                return fallback()
+            raise CircuitOpenError(f"Dependency '{self.name}' is currently unavailable")
+
+        try:
+            result = retry_with_jitter(
+                lambda: self._attempt(func, args, kwargs),
+                attempts=self.attempts,
+                base_delay=self.base_delay,
+                max_delay=self.max_delay,
+            )
+        except Exception as ex:
+            if is_transient_error(ex):
+                self.breaker.record_failure()
+            else:
+                # The dependency answered, only this request was bad, so it must not
+                # open the circuit for every other caller
+                self.breaker.record_success()
+            if fallback is not None:
+                print(f"Dependency '{self.name}' failed ({ex}), using fallback")
+                return fallback()
+            raise
+        self.breaker.record_success()
+        return result
+
+
+_dependencies: Dict[str, ResilientDependency] = {}
+_dependencies_lock = threading.Lock()
+
+
+def get_dependency(name: str) -> ResilientDependency:
+    """Returns the shared ResilientDependency for the given name, configured from
+    DEPENDENCY_POLICIES. Unknown names get a policy with no timeout and no retry."""
+    with _dependencies_lock:
+        if name not in _dependencies:
+            _dependencies[name] = ResilientDependency(name, **DEPENDENCY_POLICIES.get(name, {}))
+        return _dependencies[name]
+
+
+class FaultInjector:
+    """Local stand-in for a remote call which injects latency and failures.
+
+    Wrap a real function (or leave func empty to return a fixed value) to check
+    how the resilience layer and its fallbacks behave:
+
+        flaky_query = FaultInjector(pc_index.query, failure_rate=0.3, latency=2.0)
+        get_dependency("pinecone_query").call(flaky_query, vector=..., top_k=5)
+    """
+
+    def __init__(self, func: Optional[Callable] = None, return_value: Any = None,
+                 failure_rate: float = 0.0, latency: float = 0.0, latency_rate: float = 1.0,
+                 error: Type[Exception] = ConnectionError, seed: Optional[int] = None):
+        self.func = func
+        self.return_value = return_value
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.latency_rate = latency_rate
+        self.error = error
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.__name__ = getattr(func, "__name__", "fault_injector")
+
+    def __call__(self, *args, **kwargs) -> Any:
+        with self._lock:
+            self.calls += 1
+            slow = self._random.random() < self.latency_rate
+            fail = self._random.random() < self.failure_rate
+        if slow and self.latency > 0:
+            time.sleep(self.latency)
+        if fail:
+            raise self.error(f"Injected failure in {self.__name__}")
+        if self.func is not None:
+            return self.func(*args, **kwargs)
+        return self.return_value
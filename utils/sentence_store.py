@@ -0,0 +1,120 @@
+"""This module contains the local store of the policy sentences.
+
+The vector index keeps only the sentence IDs and their intent codes, so a query does
+not ship the text of every candidate back. The texts live here, keyed by the 32 byte
+sha256 digest behind the hex ID of generate_id_for_text, and are hydrated locally
+before the rerank. Intent names are interned as short codes."""
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+from utils.configs import (
+    DB_PATH,
+    SENTENCES_TABLE_NAME,
+    INTENT_CODES_TABLE_NAME,
+    SENTENCE_TEXT_CACHE_SIZE,
+)
+
+_lock = threading.Lock()
+# Texts never change for an ID (it is the hash of the text), so they are safe to cache
+_text_cache: "OrderedDict[str, str]" = OrderedDict()
+_intent_codes: Dict[str, str] = {}
+_intent_names: Dict[str, str] = {}
+
+
+def init_sentence_store(db_path: str = DB_PATH) -> None:
+    """Creates the sentence and intent code tables."""
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SENTENCES_TABLE_NAME} (
+                id BLOB PRIMARY KEY,
+                text TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {INTENT_CODES_TABLE_NAME} (
+                code INTEGER PRIMARY KEY,
+                intent TEXT NOT NULL UNIQUE
+            )
+        """)
+
+
+def count_sentences(db_path: str = DB_PATH) -> int:
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {SENTENCES_TABLE_NAME}").fetchone()[0]
+
+
+def save_sentences(records: Iterable[Dict], db_path: str = DB_PATH) -> None:
+    """Stores the text of every {'id', 'text'} record."""
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {SENTENCES_TABLE_NAME} (id, text) VALUES (?, ?)",
+            [(bytes.fromhex(record['id']), record['text']) for record in records]
+        )
+
+
+def get_sentence_texts(ids: List[str], db_path: str = DB_PATH) -> Dict[str, str]:
+    """Returns the texts of the given sentence IDs. Unknown IDs are left out."""
+    texts = {}
+    with _lock:
+        for sentence_id in ids:
+            if sentence_id in _text_cache:
+                _text_cache.move_to_end(sentence_id)
+                texts[sentence_id] = _text_cache[sentence_id]
+    missing = [sentence_id for sentence_id in dict.fromkeys(ids) if sentence_id not in texts]
+    if len(missing) == 0:
+        return texts
+
+    loaded = {}
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        # Chunked to stay below the SQLite limit on query parameters
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            cursor = conn.execute(
+                f"SELECT id, text FROM {SENTENCES_TABLE_NAME} WHERE id IN ({', '.join('?' * len(chunk))})",
+                [bytes.fromhex(sentence_id) for sentence_id in chunk]
+            )
+            loaded.update((row[0].hex(), row[1]) for row in cursor.fetchall())
+    texts.update(loaded)
+    with _lock:
+        _text_cache.update(loaded)
+        while len(_text_cache) > SENTENCE_TEXT_CACHE_SIZE:
+            _text_cache.popitem(last=False)
+    return texts
+
+
+def _load_intent_codes(conn: sqlite3.Connection) -> None:
+    for code, intent in conn.execute(f"SELECT code, intent FROM {INTENT_CODES_TABLE_NAME}").fetchall():
+        _intent_codes[intent] = str(code)
+        _intent_names[str(code)] = intent
+
+
+def encode_intents(intents: Iterable[str], add: bool = False, db_path: str = DB_PATH) -> List[str]:
+    """Returns the codes of the intents, as strings since vector metadata lists hold
+    strings only. With add=True unknown intents get a new code, otherwise they are
+    left out."""
+    intents = list(dict.fromkeys(intents))
+    with _lock:
+        if any(intent not in _intent_codes for intent in intents):
+            with sqlite3.connect(db_path, timeout=30) as conn:
+                if add:
+                    conn.executemany(
+                        f"INSERT OR IGNORE INTO {INTENT_CODES_TABLE_NAME} (intent) VALUES (?)",
+                        [(intent,) for intent in intents]
+                    )
+                _load_intent_codes(conn)
+        return [_intent_codes[intent] for intent in intents if intent in _intent_codes]
+
+
+def decode_intents(codes: Iterable[str], db_path: str = DB_PATH) -> List[str]:
+    """Returns the intent names of the codes. Values which are not codes (intent names
+    stored by earlier versions) are returned as they are."""
+    codes = list(codes)
+    with _lock:
+        if any(code.isdigit() and code not in _intent_names for code in codes):
+            with sqlite3.connect(db_path, timeout=30) as conn:
+                _load_intent_codes(conn)
+        return [_intent_names.get(code, code) for code in codes]
@@ -0,0 +1,204 @@
+"""This module contains the per conversation thread cache of agent tool results.
+Repeated tool calls with the same arguments inside one thread are answered from
+the cache until their TTL expires or the order sync changes the underlying order."""
+
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Any, Dict, Iterable, Optional, Set
+
+from langchain_core.runnables.config import ensure_config
+from langchain_core.tools import StructuredTool
+
+from utils import metrics
+from utils.configs import (
+    DB_PATH,
+    ORDER_CHANGES_TABLE_NAME,
+    ORDER_CHANGES_POLL_INTERVAL,
+    TOOL_CACHE_TTLS,
+    TOOL_CACHE_DAILY_TOOLS,
+    TOOL_CACHE_ORDER_KEYED_TOOLS,
+    TOOL_CACHE_MAX_THREADS,
+    TOOL_CACHE_MAX_ENTRIES_PER_THREAD,
+)
+
+_MISS = object()
+
+
+def make_cache_key(args: tuple, kwargs: dict) -> str:
+    """Builds the cache key of a tool call from its arguments."""
+    return json.dumps([list(args), kwargs], sort_keys=True, default=str)
+
+
+def get_order_id_from_key(key: str) -> Optional[int]:
+    """Returns the order ID argument of an order keyed tool call, given its cache key."""
+    args, kwargs = json.loads(key)
+    order_id = kwargs.get("order_id", args[0] if args else None)
+    try:
+        return int(order_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def seconds_until_midnight() -> float:
+    """Returns the number of seconds left in the current local day."""
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+
+class ToolResultCache:
+    """Thread scoped cache of tool results with per-tool TTLs."""
+
+    def __init__(self, ttls: Dict[str, float], daily_tools: Set[str], order_keyed_tools: Set[str],
+                 max_threads: int, max_entries_per_thread: int, db_path: str = DB_PATH):
+        self.ttls = ttls
+        self.daily_tools = daily_tools
+        self.order_keyed_tools = order_keyed_tools
+        self.max_threads = max_threads
+        self.max_entries_per_thread = max_entries_per_thread
+        self.db_path = db_path
+        self._threads: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_change_id = None
+        self._last_poll = 0.0
+
+    def is_cacheable(self, tool_name: str) -> bool:
+        return tool_name in self.ttls or tool_name in self.daily_tools
+
+    def _expiry(self, tool_name: str) -> float:
+        if tool_name in self.daily_tools:
+            return time.time() + seconds_until_midnight()
+        return time.time() + self.ttls[tool_name]
+
+    def get(self, thread_id: str, tool_name: str, key: str) -> Any:
+        """Returns the cached result, or the _MISS sentinel."""
+        if tool_name in self.order_keyed_tools:
+            self.sync_order_changes()
+        with self._lock:
+            entries = self._threads.get(thread_id)
+            if entries is None:
+                return _MISS
+            self._threads.move_to_end(thread_id)
+            entry = entries.get((tool_name, key))
+            if entry is None:
+                return _MISS
+            expires_at, result = entry
+            if expires_at <= time.time():
+                del entries[(tool_name, key)]
+                return _MISS
+            entries.move_to_end((tool_name, key))
+            return result
+
+    def put(self, thread_id: str, tool_name: str, key: str, result: Any) -> None:
+        with self._lock:
+            entries = self._threads.setdefault(thread_id, OrderedDict())
+            self._threads.move_to_end(thread_id)
+            entries[(tool_name, key)] = (self._expiry(tool_name), result)
+            entries.move_to_end((tool_name, key))
+            while len(entries) > self.max_entries_per_thread:
+                entries.popitem(last=False)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    def invalidate_orders(self, order_ids: Iterable[int]) -> int:
+        """Drops the cached results of order keyed tools for the given order IDs in
+        every thread. Returns the number of entries removed."""
+        order_ids = {int(order_id) for order_id in order_ids}
+        removed = 0
+        with self._lock:
+            for entries in self._threads.values():
+                stale = [
+                    entry_key for entry_key in entries
+                    if entry_key[0] in self.order_keyed_tools
+                    and get_order_id_from_key(entry_key[1]) in order_ids
+                ]
+                for entry_key in stale:
+                    del entries[entry_key]
+                removed += len(stale)
+        if removed:
+            metrics.increment("tool_cache.invalidations", removed)
+        return removed
+
+    def clear_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def sync_order_changes(self) -> None:
+        """Invalidates the orders written by the order sync service since the last poll.
+        The change log is read at most once every ORDER_CHANGES_POLL_INTERVAL seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_poll < ORDER_CHANGES_POLL_INTERVAL:
+                return
+            self._last_poll = now
+            last_change_id = self._last_change_id
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                if last_change_id is None:
+                    # Nothing is cached before the first poll, just note where the log is
+                    cursor.execute(f"SELECT COALESCE(MAX(change_id), 0) FROM {ORDER_CHANGES_TABLE_NAME}")
+                    self._last_change_id = cursor.fetchone()[0]
+                    return
+                cursor.execute(f"""
+                    SELECT change_id, order_id FROM {ORDER_CHANGES_TABLE_NAME}
+                    WHERE change_id > ? ORDER BY change_id
+                """, (last_change_id,))
+                rows = cursor.fetchall()
+        except sqlite3.Error:
+            # The order sync has not created its change log yet, every change is new
+            if last_change_id is None:
+                self._last_change_id = 0
+            return
+        if rows:
+            self._last_change_id = rows[-1][0]
+            self.invalidate_orders(row[1] for row in rows)
+
+
+tool_result_cache = ToolResultCache(
+    ttls=TOOL_CACHE_TTLS,
+    daily_tools=TOOL_CACHE_DAILY_TOOLS,
+    order_keyed_tools=TOOL_CACHE_ORDER_KEYED_TOOLS,
+    max_threads=TOOL_CACHE_MAX_THREADS,
+    max_entries_per_thread=TOOL_CACHE_MAX_ENTRIES_PER_THREAD,
+)
+
+
+def get_current_thread_id() -> Optional[str]:
+    """Returns the conversation thread ID of the graph run the caller is part of."""
+    configurable = ensure_config().get("configurable", {})
+    thread_id = configurable.get("thread_id")
+    return None if thread_id is None else str(thread_id)
+
+
+def cache_tool_results(tool: StructuredTool, cache: ToolResultCache = tool_result_cache) -> StructuredTool:
+    """Returns a copy of the tool whose results are cached per conversation thread.
+    Tools without a configured TTL are returned unchanged."""
+    if not cache.is_cacheable(tool.name):
+        return tool
+    func = tool.func
+
+    @wraps(func)
+    def cached_func(*args, **kwargs):
+        thread_id = get_current_thread_id()
+        if thread_id is None:
+            return func(*args, **kwargs)
+        key = make_cache_key(args, kwargs)
+        result = cache.get(thread_id, tool.name, key)
+        if result is not _MISS:
+            metrics.increment(f"tool_cache.{tool.name}.hits")
+            metrics.increment("tool_cache.saved_seconds", metrics.get_mean(f"tool.{tool.name}"))
+            return result
+
+        metrics.increment(f"tool_cache.{tool.name}.misses")
+        with metrics.timed(f"tool.{tool.name}"):
+            result = func(*args, **kwargs)
+        cache.put(thread_id, tool.name, key, result)
+        return result
+
+    return tool.model_copy(update={"func": cached_func})
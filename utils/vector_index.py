@@ -0,0 +1,517 @@
+"""This module contains a self-hosted, on-disk approximate nearest neighbour index for
+the policy sentences, used instead of Pinecone when VECTOR_STORE_BACKEND is "local".
+
+It is an IVF (inverted file) index written in NumPy. Vectors are normalized (cosine
+metric, like the Pinecone index), stored as float16 in memory mapped files and
+grouped into lists around k-means centroids. A query only scores the vectors of the
+nprobe lists closest to it, after pre-filtering them by intent. Until enough vectors
+are inserted to train the centroids, the index is a single list (exact search).
+
+LocalVectorIndex exposes the subset of the Pinecone Index API used by the app
+(upsert, fetch, query, delete) plus query_batch for vectorized batch search.
+
+Files in the index directory:
+    meta.json     dims, row count, capacity, intent vocabulary, list count
+    vectors.f16   (capacity, dims) float16 normalized vectors
+    ids.bin       (capacity,) 64 byte IDs
+    lists.<g>.i32 (capacity,) list of every row, for training generation g
+    intents.u64   (capacity,) intent bitmask of every row, for pre-filtering. With more
+                  than 64 intents codes share bits, filters on those intents are
+                  then checked exactly against the intents in records.bin
+    deleted.u8    (capacity,) tombstones
+    records.idx   (capacity, 2) offset and length of every row in records.bin
+    records.bin   JSON metadata (intent codes) of every row, append only
+    centroids.<g>.npy (nlist, dims) float32 list centroids, once trained
+
+Training writes the lists and centroids of a new generation to new files, and a
+single meta.json write switches the readers over to them.
+"""
+
+import os
+import json
+import time
+import fcntl
+import numpy as np
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from utils.configs import (
+    LOCAL_INDEX_NPROBE,
+    LOCAL_INDEX_TRAIN_MIN_ROWS,
+    LOCAL_INDEX_TRAIN_SAMPLE,
+    LOCAL_INDEX_REFRESH_INTERVAL,
+)
+
+ID_BYTES = 64
+INTENT_BITS = 64
+SEARCH_CHUNK_ROWS = 65536
+ASSIGN_CHUNK_ROWS = 8192   # rows scored against all centroids at once
+
+# name: (dtype, row shape)
+_ARRAY_FILES = {
+    "vectors.f16": (np.float16, None),
+    "ids.bin": (f"S{ID_BYTES}", ()),
+    "lists.i32": (np.int32, ()),
+    "intents.u64": (np.uint64, ()),
+    "deleted.u8": (np.uint8, ()),
+    "records.idx": (np.int64, (2,)),
+}
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Returns the rows of the matrix scaled to unit length."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Returns the indices of the k highest scores, best first."""
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over normalized vectors. Returns the normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.concatenate([
+            np.argmax(vectors[i:i + ASSIGN_CHUNK_ROWS] @ centroids.T, axis=1)
+            for i in range(0, len(vectors), ASSIGN_CHUNK_ROWS)
+        ])
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        # Re-seed the empty clusters with random vectors
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class LocalVectorIndex:
+    """On-disk IVF index with a Pinecone-like interface. Opened read-only, it picks up
+    the writes of the ingestion process every LOCAL_INDEX_REFRESH_INTERVAL seconds."""
+
+    def __init__(self, index_dir: str, dims: int, readonly: bool = False, nprobe: int = LOCAL_INDEX_NPROBE):
+        self.index_dir = index_dir
+        self.dims = dims
+        self.readonly = readonly
+        self.nprobe = nprobe
+        if not readonly:
+            os.makedirs(index_dir, exist_ok=True)
+        self._last_refresh = 0.0
+        self._meta_version = None
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    # Loading and persistence
+
+    def _read_meta(self) -> Dict:
+        try:
+            with open(self._path("meta.json"), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"dims": self.dims, "count": 0, "capacity": 0, "intents": [], "nlist": 1, "trained_count": 0,
+                    "generation": 0}
+
+    def _write_meta(self) -> None:
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path("meta.json"))
+        self._meta_version = os.stat(self._path("meta.json")).st_mtime_ns
+
+    def _file_name(self, name: str, generation: Optional[int] = None) -> str:
+        """File name of an array, the list assignments and centroids are versioned by
+        training generation. Indexes written before the generations keep the plain names."""
+        generation = self.meta.get("generation", 0) if generation is None else generation
+        if generation == 0 or name not in ("lists.i32", "centroids.npy"):
+            return name
+        stem, extension = name.split(".")
+        return f"{stem}.{generation}.{extension}"
+
+    def _map_arrays(self) -> None:
+        capacity = self.meta["capacity"]
+        mode = "r" if self.readonly else "r+"
+        for name, (dtype, row_shape) in _ARRAY_FILES.items():
+            shape = (capacity, self.dims) if row_shape is None else (capacity, *row_shape)
+            if capacity == 0:
+                array = np.zeros(shape, dtype=dtype)
+            else:
+                array = np.memmap(self._path(self._file_name(name)), dtype=dtype, mode=mode, shape=shape)
+            setattr(self, "_" + name.split(".")[0], array)
+
+    def _load(self) -> None:
+        self.meta = self._read_meta()
+        if self.meta["dims"] != self.dims:
+            raise ValueError(f"Index at {self.index_dir} has {self.meta['dims']} dims, expected {self.dims}")
+        if os.path.exists(self._path("meta.json")):
+            self._meta_version = os.stat(self._path("meta.json")).st_mtime_ns
+        self._map_arrays()
+        self._intent_codes = {intent: code for code, intent in enumerate(self.meta["intents"])}
+        self.centroids = None
+        if self.meta["nlist"] > 1:
+            self.centroids = np.load(self._path(self._file_name("centroids.npy")))
+        self._id_to_row = None
+        self._list_rows = None
+        self._intent_rows = None
+
+    def refresh(self, force: bool = False) -> None:
+        """Reloads the index if another process changed it."""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < LOCAL_INDEX_REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+        try:
+            version = os.stat(self._path("meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if version != self._meta_version:
+            self._load()
+
+    @contextmanager
+    def _write_lock(self):
+        """Serializes the writers of all processes and loads their latest changes."""
+        if self.readonly:
+            raise PermissionError("Index is opened read-only")
+        with open(self._path(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh(force=True)
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _ensure_capacity(self, rows: int) -> None:
+        capacity = self.meta["capacity"]
+        if rows <= capacity:
+            return
+        new_capacity = max(1024, capacity)
+        while new_capacity < rows:
+            new_capacity *= 2
+        self._flush()
+        for name, (dtype, row_shape) in _ARRAY_FILES.items():
+            row_size = np.dtype(dtype).itemsize * (self.dims if row_shape is None else int(np.prod(row_shape)))
+            with open(self._path(self._file_name(name)), "ab") as f:
+                f.truncate(new_capacity * row_size)
+        self.meta["capacity"] = new_capacity
+        self._map_arrays()
+
+    def _flush(self) -> None:
+        for name in _ARRAY_FILES:
+            array = getattr(self, "_" + name.split(".")[0])
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def _commit(self) -> None:
+        self._flush()
+        self._write_meta()
+
+    # Lookups
+
+    @property
+    def count(self) -> int:
+        return self.meta["count"]
+
+    def _get_id_to_row(self) -> Dict[str, int]:
+        if self._id_to_row is None:
+            ids = self._ids[:self.count]
+            self._id_to_row = {row_id.decode(): row for row, row_id in enumerate(ids.tolist())}
+        return self._id_to_row
+
+    def _get_list_rows(self) -> List[np.ndarray]:
+        if self._list_rows is None:
+            lists = np.asarray(self._lists[:self.count])
+            order = np.argsort(lists, kind="stable").astype(np.int64)
+            bounds = np.searchsorted(lists[order], np.arange(self.meta["nlist"] + 1))
+            self._list_rows = [order[bounds[i]:bounds[i + 1]] for i in range(self.meta["nlist"])]
+        return self._list_rows
+
+    def _read_records(self, rows: List[int]) -> List[Dict]:
+        with open(self._path("records.bin"), "rb") as f:
+            return [
+                json.loads(os.pread(f.fileno(), int(length), int(offset)))
+                for offset, length in self._records[rows].tolist()
+            ]
+
+    def _get_intent_rows(self) -> Dict[str, np.ndarray]:
+        """Rows of every intent, read from the records. Only built once a filter needs
+        an intent whose bit is shared with another intent."""
+        if self._intent_rows is None:
+            intent_rows = {}
+            records = self._records[:self.count].tolist()
+            with open(self._path("records.bin"), "rb") as f:
+                data = f.read()
+            for row, (offset, length) in enumerate(records):
+                for intent in json.loads(data[offset:offset + length]).get("intents", []):
+                    intent_rows.setdefault(intent, []).append(row)
+            self._intent_rows = {
+                intent: np.asarray(rows, dtype=np.int64) for intent, rows in intent_rows.items()
+            }
+        return self._intent_rows
+
+    def _intent_mask(self, intents: List[str], add: bool = False) -> np.uint64:
+        """Bitmask of the intents. Codes of 64 and above share bits with lower codes,
+        _filter_rows checks the filters on those exactly."""
+        mask = 0
+        for intent in intents:
+            if intent not in self._intent_codes:
+                if not add:
+                    continue
+                self._intent_codes[intent] = len(self.meta["intents"])
+                self.meta["intents"].append(intent)
+            mask |= 1 << (self._intent_codes[intent] % INTENT_BITS)
+        return np.uint64(mask)
+
+    def _filter_mask(self, filter: Optional[Dict]) -> Optional[np.uint64]:
+        """Converts a Pinecone style {"intents": {"$in": [...]}} filter into a bitmask."""
+        if not filter:
+            return None
+        intents = filter.get("intents", {}).get("$in", [])
+        return self._intent_mask(intents)
+
+    def _filter_rows(self, filter: Optional[Dict]) -> Optional[np.ndarray]:
+        """Returns the (count,) boolean array of the rows matching the filter, when the
+        bitmask of the filter is not exact, else None."""
+        if not filter:
+            return None
+        vocabulary_size = len(self.meta["intents"])
+        codes = [
+            self._intent_codes[intent] for intent in filter.get("intents", {}).get("$in", [])
+            if intent in self._intent_codes
+        ]
+        # The bit of a code is shared if another code is INTENT_BITS apart from it
+        if not any(code >= INTENT_BITS or code + INTENT_BITS < vocabulary_size for code in codes):
+            return None
+        intent_rows = self._get_intent_rows()
+        allowed = np.zeros(self.count, dtype=bool)
+        for intent in filter["intents"]["$in"]:
+            allowed[intent_rows.get(intent, [])] = True
+        return allowed
+
+    # Pinecone-like API
+
+    def upsert(self, vectors: List[Dict]) -> Dict:
+        """Inserts or updates vectors given as {'id', 'values', 'metadata'} dicts."""
+        with self._write_lock():
+            id_to_row = self._get_id_to_row()
+            rows = []
+            next_row = self.count
+            for vector in vectors:
+                if vector["id"] in id_to_row:
+                    rows.append(id_to_row[vector["id"]])
+                else:
+                    id_to_row[vector["id"]] = next_row
+                    rows.append(next_row)
+                    next_row += 1
+            self._ensure_capacity(next_row)
+
+            rows = np.asarray(rows, dtype=np.int64)
+            values = normalize([vector["values"] for vector in vectors])
+            self._vectors[rows] = values.astype(np.float16)
+            self._ids[rows] = [vector["id"].encode() for vector in vectors]
+            self._deleted[rows] = 0
+            self._lists[rows] = self._assign_lists(values)
+            self._intents[rows] = [
+                self._intent_mask(vector.get("metadata", {}).get("intents", []), add=True)
+                for vector in vectors
+            ]
+            with open(self._path("records.bin"), "ab") as f:
+                offset = f.tell()
+                for row, vector in zip(rows, vectors):
+                    record = json.dumps(vector.get("metadata", {})).encode()
+                    f.write(record)
+                    self._records[row] = (offset, len(record))
+                    offset += len(record)
+                f.flush()
+                os.fsync(f.fileno())
+            self.meta["count"] = next_row
+            self._list_rows = None
+            self._intent_rows = None
+            self._commit()
+
+            if self.count >= LOCAL_INDEX_TRAIN_MIN_ROWS and self.count >= 4 * self.meta["trained_count"]:
+                self._train(int(4 * np.sqrt(self.count)))
+        return {"upserted_count": len(vectors)}
+
+    def fetch(self, ids: List[str]) -> SimpleNamespace:
+        """Returns the stored vectors of the given IDs, as .vectors[id]."""
+        self.refresh()
+        id_to_row = self._get_id_to_row()
+        rows = [
+            id_to_row[vector_id] for vector_id in ids
+            if vector_id in id_to_row and not self._deleted[id_to_row[vector_id]]
+        ]
+        matches = self._to_matches(np.asarray(rows, dtype=np.int64), np.zeros(len(rows)), True, True)
+        return SimpleNamespace(vectors={
+            match["id"]: {"id": match["id"], "values": match["values"], "metadata": match["metadata"]}
+            for match in matches
+        })
+
+    def delete(self, ids: List[str]) -> Dict:
+        """Deletes the vectors of the given IDs."""
+        with self._write_lock():
+            id_to_row = self._get_id_to_row()
+            rows = [id_to_row[vector_id] for vector_id in ids if vector_id in id_to_row]
+            if rows:
+                self._deleted[np.asarray(rows)] = 1
+                self._commit()
+        return {}
+
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = False,
+              include_values: bool = False, filter: Optional[Dict] = None) -> Dict:
+        """Returns the top_k closest vectors as {"matches": [{"id", "score", "metadata"}]}."""
+        matches = self.query_batch([vector], top_k, [filter], include_metadata, include_values)[0]
+        return {"matches": matches}
+
+    def query_batch(self, vectors: List[List[float]], top_k: int, filters: Optional[List[Optional[Dict]]] = None,
+                    include_metadata: bool = False, include_values: bool = False) -> List[List[Dict]]:
+        """Vectorized query of several vectors at once, returns the matches of each one."""
+        self.refresh()
+        queries = normalize(vectors)
+        filters = filters or [None] * len(queries)
+        masks = [self._filter_mask(f) for f in filters]
+        if self.count == 0:
+            return [[] for _ in queries]
+        allowed = [self._filter_rows(f) for f in filters]
+        if self.centroids is None:
+            results = self._search_exact(queries, top_k, masks, allowed)
+        else:
+            results = [
+                self._search_ivf(query, top_k, mask, rows_allowed)
+                for query, mask, rows_allowed in zip(queries, masks, allowed)
+            ]
+        return [self._to_matches(rows, scores, include_metadata, include_values) for rows, scores in results]
+
+    def search_exact(self, vectors: List[List[float]], top_k: int,
+                     filters: Optional[List[Optional[Dict]]] = None) -> List[List[Dict]]:
+        """Brute-force search over all vectors, the ground truth for the IVF search."""
+        queries = normalize(vectors)
+        filters = filters or [None] * len(queries)
+        masks = [self._filter_mask(f) for f in filters]
+        allowed = [self._filter_rows(f) for f in filters]
+        return [self._to_matches(rows, scores, False, False)
+                for rows, scores in self._search_exact(queries, top_k, masks, allowed)]
+
+    # Search internals
+
+    def _assign_lists(self, values: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.zeros(len(values), dtype=np.int32)
+        return np.argmax(values @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _valid_rows(self, rows: np.ndarray, mask: Optional[np.uint64],
+                    allowed: Optional[np.ndarray] = None) -> np.ndarray:
+        valid = self._deleted[rows] == 0
+        if mask is not None:
+            valid &= (self._intents[rows] & mask) != 0
+        if allowed is not None:
+            valid &= allowed[rows]
+        return rows[valid]
+
+    def _search_exact(self, queries: np.ndarray, top_k: int, masks: List[Optional[np.uint64]],
+                      allowed: Optional[List[Optional[np.ndarray]]] = None):
+        allowed = allowed or [None] * len(queries)
+        best_rows = [np.empty(0, dtype=np.int64) for _ in queries]
+        best_scores = [np.empty(0, dtype=np.float32) for _ in queries]
+        for start in range(0, self.count, SEARCH_CHUNK_ROWS):
+            rows = np.arange(start, min(start + SEARCH_CHUNK_ROWS, self.count))
+            chunk_scores = np.asarray(self._vectors[start:start + len(rows)], dtype=np.float32) @ queries.T
+            alive = self._deleted[rows] == 0
+            intents = self._intents[rows]
+            for i, mask in enumerate(masks):
+                valid = alive if mask is None else alive & ((intents & mask) != 0)
+                if allowed[i] is not None:
+                    valid = valid & allowed[i][rows]
+                rows_i = np.concatenate([best_rows[i], rows[valid]])
+                scores_i = np.concatenate([best_scores[i], chunk_scores[valid, i]])
+                top = top_k_indices(scores_i, top_k)
+                best_rows[i], best_scores[i] = rows_i[top], scores_i[top]
+        return list(zip(best_rows, best_scores))
+
+    def _search_ivf(self, query: np.ndarray, top_k: int, mask: Optional[np.uint64],
+                    allowed: Optional[np.ndarray] = None):
+        list_rows = self._get_list_rows()
+        list_order = np.argsort(-(self.centroids @ query))
+        nprobe = min(self.nprobe, len(list_order))
+        while True:
+            rows = self._valid_rows(np.concatenate([list_rows[l] for l in list_order[:nprobe]]), mask, allowed)
+            # Probe more lists when the intent filter leaves too few candidates
+            if len(rows) >= top_k or nprobe >= len(list_order):
+                break
+            nprobe = min(nprobe * 2, len(list_order))
+        # Sorted rows read the memory mapped vectors sequentially
+        rows = np.sort(rows)
+        scores = np.asarray(self._vectors[rows], dtype=np.float32) @ query
+        top = top_k_indices(scores, top_k)
+        return rows[top], scores[top]
+
+    def _to_matches(self, rows: np.ndarray, scores: np.ndarray, include_metadata: bool,
+                    include_values: bool) -> List[Dict]:
+        rows = rows.tolist()
+        metadata = self._read_records(rows) if include_metadata and rows else None
+        matches = []
+        for i, (row, score) in enumerate(zip(rows, scores.tolist())):
+            match = {"id": self._ids[row].decode(), "score": score}
+            if include_metadata:
+                match["metadata"] = metadata[i]
+            if include_values:
+                match["values"] = self._vectors[row].astype(np.float32).tolist()
+            matches.append(match)
+        return matches
+
+    # Training
+
+    def _train(self, nlist: int) -> None:
+        """Trains the list centroids on a sample of the vectors and re-assigns all rows.
+        Must be called with the write lock held. The new lists and centroids are written
+        to the files of the next generation, which the meta commit switches to at once,
+        so readers never see new centroids with old list assignments."""
+        live_rows = np.flatnonzero(self._deleted[:self.count] == 0)
+        nlist = max(1, min(nlist, len(live_rows)))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(live_rows, min(len(live_rows), LOCAL_INDEX_TRAIN_SAMPLE), replace=False))
+        print(f"Training {nlist} lists on {len(sample)} of {len(live_rows)} vectors")
+        centroids = kmeans(np.asarray(self._vectors[sample], dtype=np.float32), nlist)
+
+        old_generation = self.meta.get("generation", 0)
+        generation = old_generation + 1
+        np.save(self._path(self._file_name("centroids.npy", generation)), centroids)
+        lists = np.memmap(self._path(self._file_name("lists.i32", generation)), dtype=np.int32,
+                          mode="w+", shape=(self.meta["capacity"],))
+        self.centroids = centroids
+        for start in range(0, self.count, ASSIGN_CHUNK_ROWS):
+            chunk = np.asarray(self._vectors[start:start + ASSIGN_CHUNK_ROWS], dtype=np.float32)
+            lists[start:start + len(chunk)] = self._assign_lists(chunk)
+        lists.flush()
+        del lists
+
+        self.meta["generation"] = generation
+        self.meta["nlist"] = nlist
+        self.meta["trained_count"] = self.count
+        self._commit()
+        self._map_arrays()
+        self._list_rows = None
+        # Readers may still be loading the previous generation, the one before it is unused
+        for name in ("lists.i32", "centroids.npy"):
+            if old_generation >= 1:
+                stale_path = self._path(self._file_name(name, old_generation - 1))
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+
+    def train(self, nlist: Optional[int] = None) -> None:
+        """Trains (or re-trains) the list centroids, by default 4 * sqrt(count) lists."""
+        with self._write_lock():
+            self._train(nlist or int(4 * np.sqrt(self.count)))
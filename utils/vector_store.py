@@ -0,0 +1,41 @@
+"""This module contains the functions which create or load the policy vector index.
+They are kept apart from the ingestion code, which the chat app does not need."""
+
+import os
+import time
+from pinecone import Pinecone, ServerlessSpec
+
+from utils.configs import (
+   VECTOR_STORE_BACKEND,
+   LOCAL_INDEX_DIR
+)
+
+def create_or_load_pinecone_index(index_name: str, embedding_dims: int) -> Pinecone.Index:
+    """Creates or loads a Pinecone index."""
+    pinecone_api_key = os.environ.get("PINECONE_API_KEY")
+    pc = Pinecone(api_key=pinecone_api_key)
+
+    if not pc.has_index(index_name):
+        pc.create_index(
+            name=index_name,
+            dimension=embedding_dims,
+            metric="cosine",
+            spec=ServerlessSpec(
+                cloud="aws",
+                region="us-east-1"
+            ),
+        )
+        while not pc.describe_index(index_name).status["ready"]:
+            time.sleep(1)
+        print(f"Index {index_name} is ready")
+    else:
+        print(f"Index {index_name} already exists")
+    return pc.Index(index_name)
+
+def create_or_load_vector_index(index_name: str, embedding_dims: int, readonly: bool = False):
+    """Creates or loads the vector index of the configured VECTOR_STORE_BACKEND: the
+    Pinecone index, or the local IVF index which offers the same interface."""
+    if VECTOR_STORE_BACKEND == "local":
+        from utils.vector_index import LocalVectorIndex
+        return LocalVectorIndex(LOCAL_INDEX_DIR, embedding_dims, readonly=readonly)
+    return create_or_load_pinecone_index(index_name, embedding_dims)